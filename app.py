@@ -3,21 +3,15 @@ import matplotlib as mpl
 mpl.use("agg")
 
 import streamlit as st
-import numpy as np
-import matplotlib.pyplot as plt
-import requests, os
-from gwpy.timeseries import TimeSeries
-from gwosc.locate import get_urls
-from gwosc import datasets
-from gwosc.api import fetch_event_json
-from copy import deepcopy
-import io
-from scipy import signal
-from scipy.io import wavfile
-from freqdomain2 import showfreqdomain
 
 # -- Helper functions in this git repo
 from helper import *
+import metrics
+import quality
+
+# -- Heavier modules (plotting, filtering, the frequency-domain page) are
+# -- imported inside the sections that use them, so a session only pays
+# -- for the sections it actually opens
 
 apptitle = 'Signal Processing Tutorial'
 
@@ -27,41 +21,17 @@ st.set_page_config(page_title=apptitle, page_icon=":headphones:",
 # Title the app
 st.title(apptitle)
 
-fs = 32000
-noisedt = 8
-noise = deepcopy(makewhitenoise(fs, noisedt))
-
-#-- Try to color the noise
-noisefreq = noise.fft()
-color = 1.0 / (noisefreq.frequencies)**2
-indx = np.where(noisefreq.frequencies.value < 30)
-color[indx] = 0  #-- Apply low frequency cut-off at 30 Hz
-
-#-- Red noise in frequency domain
-weightedfreq = noisefreq * color.value
-
-# -- Try returning to time domain
-colorednoise = weightedfreq.ifft()
+# -- Per-stage timings for this rerun, and the /metrics endpoint if enabled
+metrics.begin_run()
+metrics.serve()
 
-###
-# -- Inject the signal
-###
-secret = TimeSeries.read('LOZ_Secret.wav')
-
-# -- Normalize and convert to float
-secret -= secret.value[0]  #-- Remove constant offset
-secret = np.float64(secret)
-secret = secret/np.max(np.abs(secret)) * 1*1e-8   #-- Set amplitude
-secret.t0 = 4
+# -- The quality tier this rerun uses, picked from the recent load
+quality.begin_run()
 
+fs = FS
+noisedt = NOISEDT
 volume = st.sidebar.radio("Secret sound volume", ["Default", "Louder"])
 
-if volume == 'Louder':
-    maze = colorednoise.inject(10*secret)
-else:
-# -- Might be useful to make easier to hear option
-    maze = colorednoise.inject(secret)
-
 
 # -------
 # Begin Display Here
@@ -84,22 +54,33 @@ sectionnames = [
                 'Find the Secret Sound',
                 'Whitening',
                 'Gravitational Wave Data',
+                'Spectrograms',
 ]
 
 def headerlabel(number):
     return "{0}: {1}".format(number, sectionnames[number-1])
     
-page = st.radio('Select Section:', [1,2,3,4,5,6], format_func=headerlabel)
+page = st.radio('Select Section:', [1,2,3,4,5,6,7], format_func=headerlabel)
 
 st.markdown("## {}".format(headerlabel(page)))
+pagetimer = metrics.start('page{0}'.format(page))
+
+if page in [2, 3, 4, 5, 7]:
+    # -- The noise and secret sound are only used by these sections
+    scenario = makescenario(fs, noisedt)
+    noise = scenario['noise']
+    secret = scenario['secret']
+    maze = scenario['maze'][volume]
 
 if page==1:
-    
+
+    from freqdomain2 import showfreqdomain
     showfreqdomain()
     
 if page==2:
 
     # White Noise
+    import plots
     
     st.markdown("""
     Next, let's take a look at some **white noise**.  Any 
@@ -126,8 +107,7 @@ if page==2:
     or fractional change in length - of the observatory's arms.
     """)
 
-    tplot = noise.plot(ylabel='Pressure')
-    st.pyplot(tplot)
+    st.image(plots.timeseries(noise, ylabel='Pressure'), width='stretch')
     
     st.markdown("### Frequency domain")
 
@@ -141,8 +121,8 @@ if page==2:
     frequency, this plot is mostly flat as you move from left to right.
     """)
 
-    figwn = noise.asd(fftlength=1).plot(ylim=[1e-10, 1], ylabel='Amplitude Spectral Density')
-    st.pyplot(figwn)
+    figwn = plots.asd(noise, 1, ylim=[1e-10, 1], ylabel='Amplitude Spectral Density')
+    st.image(figwn, width='stretch')
 
     st.markdown("### Audio player")
     st.markdown("""
@@ -150,7 +130,7 @@ if page==2:
     a hiss of white noise**.
     """)
     
-    st.audio(make_audio_file(noise), format='audio/wav')
+    play(noise)
 
     st.markdown("")
     st.markdown("""
@@ -161,6 +141,7 @@ if page==2:
 if page == 3:
 
     # st.markdown("## 3: Red Noise")
+    import plots
     
     st.markdown("""
     Next, we'll look at some **red noise**.  Red noise 
@@ -189,15 +170,15 @@ if page == 3:
 
     st.markdown("In the time-domain, you can see the red noise looks random.")
 
-    figrnt = maze.plot(ylabel='Pressure')
-    st.pyplot(figrnt)
+    figrnt = plots.timeseries(maze, ylabel='Pressure')
+    st.image(figrnt, width='stretch')
 
     st.markdown("In the frequency-domain, the red noise has lots of power at low frequencies.")
 
-    figrn = maze.asd(fftlength=1).plot(ylabel='Amplitude Spectral Density', ylim=[1e-11, 1e-4], xlim=[30, fs/2])
-    st.pyplot(figrn)
+    figrn = plots.asd(maze, 1, ylabel='Amplitude Spectral Density', ylim=[1e-11, 1e-4], xlim=[30, fs/2])
+    st.image(figrn, width='stretch')
         
-    st.audio(make_audio_file(maze), format='audio/wav')
+    play(maze)
     st.markdown("""
     Can you hear the bullfrogs cheering?
 
@@ -210,6 +191,8 @@ if page == 4:
     # Try to recover the signal
     # ----
     # st.markdown("## 4: Find the Secret Sound")
+    import pipelines, workers
+    from memo import digest
     
     st.markdown("""
     The red noise above isn't just noise - there's a secret sound 
@@ -235,22 +218,31 @@ if page == 4:
 
     lowfreq = st.slider("High pass filter cutoff frequency (Hz)", 0, 3000, 0, step=100)
     if lowfreq == 0: lowfreq=1
+    showcurve = st.checkbox("Show how loud the secret sound is for every cutoff", value=False)
 
-    highpass = maze.highpass(lowfreq)
-    #st.pyplot(highpass.plot())
+    # -- Every slider value, as filtered (0 Hz is 1 Hz)
+    cutoffs = (1,) + tuple(range(100, 3001, 100))
+    # -- The secret as it was injected into this maze
+    injected = (10*secret if volume == 'Louder' else secret) if showcurve else None
 
-    fighp = highpass.asd(fftlength=1).plot(ylabel='Amplitude Spectral Density',
-                                           ylim=[1e-12, 1e-5],
-                                           xlim=[30, fs/2]
-                                           )
-    ax = fighp.gca()
-    ax.axvspan(1, lowfreq, color='red', alpha=0.3, label='Removed by filter')
-    st.pyplot(fighp)
+    # -- Filter, ASD, plot and audio run on the worker pool
+    result = workers.run('highpass',
+                         (digest(maze), lowfreq, None if injected is None else digest(injected)),
+                         pipelines.highpass, maze, fs, lowfreq, injected, cutoffs)
+    st.image(result['spectrum'], width='stretch')
 
-    st.audio(make_audio_file(highpass), format='audio/wav')
+    st.audio(*result['audio'])
 
     st.markdown("Can you hear the sound now?  What value of the cutoff frequency makes it easiest to hear?")
 
+    if showcurve:
+        st.markdown("""Because we know what the secret sound is, we can measure
+        how loud it is compared to the noise (its **signal-to-noise ratio**)
+        after filtering with each cutoff frequency.  The red line marks your
+        cutoff.
+        """)
+        st.image(result['curve'], width='stretch')
+
     st.markdown("")
     needhint = st.checkbox("Need a hint?", value=False)
 
@@ -260,7 +252,7 @@ if page == 4:
         red noise above?
         """)
 
-        st.audio(make_audio_file(secret), format='audio/wav')
+        play(secret)
 
         st.markdown("""You can also make the sound easier to hear by 
         clicking the 'Louder' option in the menu at left
@@ -268,6 +260,8 @@ if page == 4:
         
 if page == 5:
     # st.markdown("## 5: Whitening")
+    import pipelines, workers
+    from memo import digest
 
     st.markdown("""
     **Whitening** is a process that re-weights a signal, so that all
@@ -282,10 +276,8 @@ if page == 5:
     
     whiten = st.checkbox("Whiten the data?", value=False)
 
-    if whiten:
-        whitemaze = maze.whiten()
-    else:
-        whitemaze = maze
+    result = workers.run('whiten', (digest(maze), whiten),
+                         pipelines.whitening, maze, fs, whiten)
 
     st.markdown("""
     After whitening, you can see the secret sound in the time domain.  You 
@@ -296,12 +288,11 @@ if page == 5:
     applications.
     """)
     
-    st.pyplot(whitemaze.plot())
+    st.image(result['timeseries'], width='stretch')
 
-    figwh = whitemaze.asd(fftlength=1).plot(ylim=[1e-12, 1], xlim=[30,fs/2], ylabel='Amplitude Spectral Density')
-    st.pyplot(figwh)
+    st.image(result['spectrum'], width='stretch')
     
-    st.audio(make_audio_file(whitemaze), format='audio/wav')
+    st.audio(*result['audio'])
 
     st.markdown("""Try using the checkbox to whiten the data.  Is it 
     easier to hear the secret sound with or without whitening?
@@ -310,10 +301,12 @@ if page == 5:
 if page == 6:
 
     # st.markdown("## 6: Gravitational Wave Data")
+    import events, pipelines, workers
+    from memo import digest
 
     st.markdown("""
     Finally, we'll try what we've learned on some real 
-    gravitational-wave data from LIGO, around the binary black 
+    gravitational-wave data from LIGO and Virgo, starting with the binary black 
     hole signal GW150914.  We'll add one more element: 
     a **bandpass filter**.  A bandpass filter uses both a low frequency
     cutoff and a high frequency cutoff, and only passes signals in the 
@@ -323,14 +316,20 @@ if page == 6:
     gravitational wave signal in the data below.**  
     """)
 
-    detector = 'H1'
-    t0 = 1126259462.4   #-- GW150914
+    catalog = events.catalog()
+    names = list(catalog)
+    event = st.selectbox("Event", names, index=names.index('GW150914'))
+    t0, available = catalog[event]
+    detectors = st.multiselect("Detectors", available, default=available) or available
+
+    st.text("Detectors: {0}".format(', '.join(detectors)))
+    st.text("Time: {0} ({1})".format(t0, event))
 
-    st.text("Detector: {0}".format(detector))
-    st.text("Time: {0} (GW150914)".format(t0))
-    strain = load_gw(t0, detector)
-    center = int(t0)
-    strain = strain.crop(center-14, center+14)
+    # -- All detectors are loaded at once, then the next events are
+    # -- fetched in the background
+    with st.spinner("Loading strain..."):
+        strains = events.load(event, detectors)
+    events.prefetch(event)
 
     # -- Try whitened and band-passed plot
     # -- Whiten and bandpass data
@@ -341,33 +340,30 @@ if page == 6:
 
     makewhite = st.checkbox("Apply whitening", value=False)
 
-    if makewhite:
-        white_data = strain.whiten()
-    else:
-        white_data = strain
-
-    bp_data = white_data.bandpass(lowfreqreal, highfreqreal)
+    result = workers.run('bandpass',
+                         (tuple(strains), t0)
+                         + tuple(digest(strain) for strain in strains.values())
+                         + (makewhite, lowfreqreal, highfreqreal),
+                         pipelines.bandpass, strains, t0, makewhite,
+                         lowfreqreal, highfreqreal)
 
     st.markdown("""
     With the right filtering, you might be able to see the signal in the time domain plot.
     """)
 
-    fig3 = bp_data.plot(xlim=[t0-0.1, t0+0.1])
-    st.pyplot(fig3)
+    # -- One column per detector
+    columns = st.columns(len(detectors))
+    for column, detector in zip(columns, detectors):
+        column.markdown("**{0}**".format(detector))
+        column.image(result[detector]['timeseries'], width='stretch')
 
     # -- PSD of whitened data
-    # -- Plot psd
-    psdfig = bp_data.asd(fftlength=4).plot(xlim=[10, 1800], ylabel='Amplitude Spectral Density')    
-    ax = psdfig.gca()
-    ax.axvspan(1, lowfreqreal, color='red', alpha=0.3, label='Removed by filter')
-    ax.axvspan(highfreqreal, 1800, color='red', alpha=0.3, label='Removed by filter')
-    st.pyplot(psdfig)
+    for column, detector in zip(columns, detectors):
+        column.image(result[detector]['spectrum'], width='stretch')
 
     # -- Audio
-    st.audio(make_audio_file(bp_data.crop(t0-1, t0+1)), format='audio/wav')
-
-    # -- Close all open figures
-    plt.close('all')
+    for column, detector in zip(columns, detectors):
+        column.audio(*result[detector]['audio'])
 
     st.markdown("""With the right filtering, you might be able to hear
     the black hole signal.  It doesn't sound like much - just a quick thump.  
@@ -386,6 +382,67 @@ if page == 6:
         
         st.image('https://journals.aps.org/prl/article/10.1103/PhysRevLett.116.061102/figures/1/large')
 
+if page == 7:
+
+    import events, pipelines, workers
+    from memo import digest
+
+    st.markdown("""
+    A **spectrogram** shows how the frequency content of a signal changes
+    over time: time runs along the x-axis, frequency up the y-axis, and the
+    colour shows how much power there is at each time and frequency.
+    Sounds that are hard to pick out in a time series or a spectrum on
+    their own often stand out clearly here.
+
+    :point_right: **Pick a signal, then use the sliders to zoom in on the
+    times and frequencies where something is going on.**
+    """)
+
+    source = st.radio("Signal", ["Maze", "Highpassed maze", "Whitened maze",
+                                 "Whitened GW150914 (H1)"])
+
+    highpass = whiten = None
+    if source == "Whitened GW150914 (H1)":
+        gps, _ = events.catalog()['GW150914']
+        with st.spinner("Loading strain..."):
+            series = events.load('GW150914', ['H1'])['H1']
+        epoch = gps
+        fftlength = 1.0/16
+        whiten = True
+        start, end = st.slider("Time around the event (s)", -10.0, 10.0,
+                               value=(-1.0, 0.5), step=0.1)
+        flim = st.slider("Frequency range (Hz)", 0, 2000, value=(20, 500), step=10)
+    else:
+        series = maze
+        epoch = maze.t0.value
+        fftlength = 1.0/32
+        if source == "Highpassed maze":
+            highpass = st.slider("High pass filter cutoff frequency (Hz)",
+                                 100, 3000, 1000, step=100)
+        if source == "Whitened maze":
+            whiten = True
+        start, end = st.slider("Time (s)", 0.0, float(noisedt),
+                               value=(0.0, float(noisedt)), step=0.1)
+        flim = st.slider("Frequency range (Hz)", 0, fs//2, value=(0, 8000), step=100)
+
+    tlim = (epoch + start, epoch + end)
+    # -- Only the tiles in view are computed, and each only once
+    image = workers.run('spectrogram',
+                        (digest(series), fftlength, tlim, flim, highpass, whiten),
+                        pipelines.spectrogram, series, fftlength, tlim, flim, epoch,
+                        highpass, whiten)
+    st.image(image, width='stretch')
+
+    st.markdown("""
+    Can you find the secret sound in the maze?  Try the highpassed and
+    whitened versions too.  In the gravitational-wave data, look for the
+    **chirp**: a signal that sweeps up in frequency in the last fraction
+    of a second before the black holes merge.
+    """)
+
+quality.observe(pagetimer.stop().seconds)
+metrics.panel()
+
 st.markdown("""## About this app
 
 This app displays data from LIGO, Virgo, and GEO downloaded from the Gravitational Wave Open Science Center at 
@@ -0,0 +1,243 @@
+import io
+import math
+import os
+import struct
+
+import numpy as np
+from scipy import signal
+
+import bundle
+import metrics
+from memo import ByteLRU, digest
+
+# -- Samples processed per block while encoding
+BLOCKSIZE = 2**16
+
+# -- Finished WAV payloads, shared by all sessions
+WAV_CACHE_BYTES = 128 * 2**20
+wavcache = ByteLRU(WAV_CACHE_BYTES, name='wav')
+
+# -- Compressed clips (see encode), shared by all sessions
+CLIP_CACHE_BYTES = 32 * 2**20
+clipcache = ByteLRU(CLIP_CACHE_BYTES, name='clips')
+
+# -- Codec for clips sent to the browser: 'wav', 'flac' (lossless) or
+# -- 'opus' (lossy, at BITRATE bits/s).  FLAC and Opus need soundfile;
+# -- without it every clip is sent as WAV
+CODEC = os.environ.get('AUDIO_CODEC', 'flac')
+BITRATE = int(os.environ.get('AUDIO_BITRATE', 64000))
+FORMATS = {'wav': 'audio/wav', 'flac': 'audio/flac', 'opus': 'audio/ogg'}
+
+# -- Sample rates Opus accepts, and the bitrates libsndfile maps its
+# -- compression level onto (0 -> highest, 1 -> lowest)
+OPUS_RATES = (8000, 12000, 16000, 24000, 48000)
+OPUS_BITRATES = (256000, 6000)
+
+
+def _tukey(start, stop, length, alpha):
+    # -- Samples [start, stop) of signal.windows.tukey(length, alpha),
+    # -- using the same expressions so the values match it bit for bit
+    if length <= 1 or alpha <= 0:
+        return np.ones(stop - start)
+    if alpha >= 1.0:
+        return signal.windows.tukey(length, alpha)[start:stop]
+
+    n = np.arange(start, stop, dtype=np.float64)
+    w = np.ones(stop - start)
+    width = int(np.floor(alpha*(length-1)/2.0))
+
+    head = n < width+1
+    if head.any():
+        w[head] = 0.5 * (1 + np.cos(np.pi * (-1 + 2.0*n[head]/alpha/(length-1))))
+    tail = n >= length-width-1
+    if tail.any():
+        w[tail] = 0.5 * (1 + np.cos(np.pi * (-2.0/alpha + 1 + 2.0*n[tail]/alpha/(length-1))))
+    return w
+
+
+def _header(rate, nsamp):
+    # -- 16 bit mono PCM header, as written by scipy.io.wavfile.write
+    nbytes = 2*nsamp
+    fmt = struct.pack('<HHIIHH', 1, 1, rate, 2*rate, 2, 16)
+    return (b'RIFF' + struct.pack('<I', 4 + 8 + len(fmt) + 8 + nbytes) + b'WAVE'
+            + b'fmt ' + struct.pack('<I', len(fmt)) + fmt
+            + b'data' + struct.pack('<I', nbytes))
+
+
+def _samples(series):
+    return np.asarray(getattr(series, 'value', series))
+
+
+def _rate(series, rate):
+    if rate is None:
+        rate = 1/series.dt.value
+    return int(rate)
+
+
+def _factor(rate, maxrate):
+    # -- Smallest integer factor that brings rate down to maxrate or below
+    return max(1, -(-rate // maxrate)) if maxrate else 1
+
+
+def _decimated(series, factor):
+    # -- Low-passed and resampled down by factor (see quality.py)
+    if factor == 1:
+        return series
+    with metrics.stage('decimate'):
+        return signal.resample_poly(_samples(series), 1, factor)
+
+
+def _chunks(series, blocksize):
+    data = _samples(series)
+    return (data[start:start+blocksize] for start in range(0, len(data), blocksize))
+
+
+def _peak(chunks, length, alpha):
+    peaks = []
+    start = 0
+    for chunk in chunks:
+        stop = start + len(chunk)
+        peaks.append(np.max(np.abs(chunk * _tukey(start, stop, length, alpha))))
+        start = stop
+    return np.max(peaks)
+
+
+def peak(series, alpha=0.1, blocksize=BLOCKSIZE):
+    # -- Largest windowed amplitude, found one block at a time
+    return _peak(_chunks(series, blocksize), len(series), alpha)
+
+
+def _encode(chunks, length, top, alpha, scale):
+    # -- Window, normalize and cast to int16 block by block, reusing
+    # -- the same two buffers.  Yields views into the int16 buffer
+    fbuf = ibuf = None
+    start = 0
+    for chunk in chunks:
+        stop = start + len(chunk)
+        if fbuf is None or len(fbuf) < len(chunk):
+            fbuf = np.empty(len(chunk))
+            ibuf = np.empty(len(chunk), dtype='<i2')
+        f = fbuf[:stop-start]
+        np.multiply(chunk, _tukey(start, stop, length, alpha), out=f)
+        np.divide(f, top, out=f)
+        np.multiply(f, 32767, out=f)
+        np.multiply(f, scale, out=f)
+        i = ibuf[:stop-start]
+        i[...] = f
+        start = stop
+        yield i
+
+
+def _blocks(series, alpha, scale, blocksize):
+    top = peak(series, alpha, blocksize)
+    return _encode(_chunks(series, blocksize), len(series), top, alpha, scale)
+
+
+def write_wav(series, fileobj, rate=None, alpha=0.1, scale=0.9, blocksize=BLOCKSIZE):
+    # -- Stream a 16 bit WAV file into fileobj.  Peak memory is set by
+    # -- blocksize, not by the length of the signal
+    fileobj.write(_header(_rate(series, rate), len(series)))
+    for block in _blocks(series, alpha, scale, blocksize):
+        fileobj.write(block.data)
+    return fileobj
+
+
+def write_wav_blocks(makeblocks, length, rate, fileobj, alpha=0.1, scale=0.9):
+    # -- As write_wav, for a signal that is only ever held one block at a
+    # -- time.  makeblocks() must return a fresh iterator over the same
+    # -- length samples each call: once to find the peak, once to write
+    top = _peak(makeblocks(), length, alpha)
+    fileobj.write(_header(int(rate), length))
+    for block in _encode(makeblocks(), length, top, alpha, scale):
+        fileobj.write(block.data)
+    return fileobj
+
+
+def encode_wav(series, rate=None, alpha=0.1, scale=0.9, maxrate=None):
+    # -- WAV bytes for series, encoded once per distinct input and
+    # -- encoding parameters.  Every caller gets the same bytes object.
+    # -- Series faster than maxrate are decimated first
+    rate = _rate(series, rate)
+    factor = _factor(rate, maxrate)
+    key = digest(series, 'wav', rate, alpha, scale, factor)
+
+    def compute():
+        payload = bundle.payload('wav', key)
+        if payload is None:
+            with metrics.stage('encode_wav') as record:
+                payload = write_wav(_decimated(series, factor), io.BytesIO(),
+                                    rate // factor, alpha, scale).getvalue()
+                record.nbytes = len(payload)
+        return payload
+
+    return wavcache.get_or_compute(key, compute)
+
+
+def _soundfile():
+    try:
+        import soundfile
+    except ImportError:
+        return None
+    return soundfile
+
+
+def _pcm(series, alpha, scale):
+    # -- The int16 samples write_wav would write
+    return np.concatenate([block.copy() for block in _blocks(series, alpha, scale, BLOCKSIZE)])
+
+
+def _flac(soundfile, pcm, rate, bitrate):
+    out = io.BytesIO()
+    soundfile.write(out, pcm, rate, format='FLAC', subtype='PCM_16')
+    return out.getvalue()
+
+
+def _opus(soundfile, pcm, rate, bitrate):
+    # -- Opus only takes a few sample rates: resample up to the nearest
+    opusrate = min([r for r in OPUS_RATES if r >= rate] or [OPUS_RATES[-1]])
+    data = pcm / 32768.0
+    if opusrate != rate:
+        g = math.gcd(opusrate, rate)
+        data = np.clip(signal.resample_poly(data, opusrate // g, rate // g), -1, 1)
+    high, low = OPUS_BITRATES
+    level = min(max((high - bitrate) / (high - low), 0.0), 1.0)
+    out = io.BytesIO()
+    soundfile.write(out, data, opusrate, format='OGG', subtype='OPUS',
+                    compression_level=level)
+    return out.getvalue()
+
+
+_ENCODERS = {'flac': _flac, 'opus': _opus}
+
+
+def encode(series, codec=None, bitrate=None, rate=None, alpha=0.1, scale=0.9, maxrate=None):
+    # -- (payload, format for st.audio) in codec (CODEC if None), with the
+    # -- same windowing, scaling and decimation as encode_wav.  Encoded
+    # -- once per distinct input and settings
+    codec = codec or CODEC
+    if codec not in FORMATS:
+        raise ValueError("Unknown audio codec '{0}'".format(codec))
+    rate = _rate(series, rate)
+    factor = _factor(rate, maxrate)
+    bitrate = bitrate or BITRATE
+    if codec == 'opus' and 16*(rate // factor) < 2*bitrate:
+        codec = 'flac'   #-- Low rate clips (4 kHz strain) gain nothing from Opus
+    soundfile = _soundfile() if codec != 'wav' else None
+    if soundfile is None:
+        if codec != 'wav':
+            metrics.count('audio_fallback', codec)
+        return encode_wav(series, rate, alpha, scale, maxrate), FORMATS['wav']
+
+    key = digest(series, codec, rate, alpha, scale, factor,
+                 bitrate if codec == 'opus' else None)
+
+    def compute():
+        payload = bundle.payload('clips', key)
+        if payload is None:
+            with metrics.stage('encode_' + codec) as record:
+                pcm = _pcm(_decimated(series, factor), alpha, scale)
+                payload = _ENCODERS[codec](soundfile, pcm, rate // factor, bitrate)
+                record.nbytes = len(payload)
+        return payload
+
+    return clipcache.get_or_compute(key, compute), FORMATS[codec]
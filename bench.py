@@ -0,0 +1,171 @@
+"""Render-latency benchmarks for each section of app.py.
+
+Drives the app headlessly with Streamlit's AppTest, with GWOSC replaced by
+the offline stand-in in gwoscfixture.py, and writes the results as JSON::
+
+    python bench.py [--repeat N] [--output bench_results.json] [--only NAME]
+                    [--quality full|reduced|minimal|auto]
+
+For every scenario this records the time to navigate to the section, the
+first render with the scenario's widget values, the median of repeated
+warm reruns, the process RSS and peak RSS, and the hits and misses of
+each shared cache during the scenario.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import time
+
+from streamlit.testing.v1 import AppTest
+
+import gwoscfixture
+import memo
+import quality
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+
+# -- (name, section, [(widget type, label, value), ...]).  A label ending
+# -- in [n] picks the n-th widget with that label
+SCENARIOS = [
+    ('target', 1, []),
+    ('target fft', 1, [('checkbox', 'Convert target signal to the frequency domain', True)]),
+    ('target guess', 1, [('slider', 'Frequency (Hz)[0]', 200),
+                         ('number_input', 'Amplitude[0]', 4),
+                         ('slider', 'Frequency (Hz)[1]', 250),
+                         ('number_input', 'Amplitude[1]', 3)]),
+    ('white noise', 2, []),
+    ('red noise', 3, []),
+    ('red noise louder', 3, [('radio', 'Secret sound volume', 'Louder')]),
+] + [
+    ('highpass {0}'.format(cutoff), 4,
+     [('radio', 'Secret sound volume', 'Default'),
+      ('slider', 'High pass filter cutoff frequency (Hz)', cutoff)])
+    for cutoff in (0, 500, 1000, 1500, 2000, 2500, 3000)
+] + [
+    ('highpass hint', 4, [('checkbox', 'Need a hint?', True)]),
+    ('highpass curve', 4, [('checkbox', 'Show how loud the secret sound is for every cutoff', True)]),
+    ('whiten off', 5, [('checkbox', 'Whiten the data?', False)]),
+    ('whiten on', 5, [('checkbox', 'Whiten the data?', True)]),
+    ('gw raw', 6, [('slider', 'Band-pass filter cutoff (Hz)', (1, 1200)),
+                   ('checkbox', 'Apply whitening', False)]),
+    ('gw whitened', 6, [('checkbox', 'Apply whitening', True)]),
+    ('gw bandpass grid', 6, [('slider', 'Band-pass filter cutoff (Hz)', (30, 400)),
+                             ('checkbox', 'Apply whitening', True)]),
+    ('gw bandpass off grid', 6, [('slider', 'Band-pass filter cutoff (Hz)', (35, 350)),
+                                 ('checkbox', 'Apply whitening', True)]),
+    ('gw three detectors', 6, [('selectbox', 'Event', 'GW170814'),
+                               ('slider', 'Band-pass filter cutoff (Hz)', (30, 400)),
+                               ('checkbox', 'Apply whitening', True)]),
+    ('gw one detector', 6, [('selectbox', 'Event', 'GW170814'),
+                            ('multiselect', 'Detectors', ['L1'])]),
+    ('spectrogram maze', 7, []),
+    ('spectrogram zoom', 7, [('slider', 'Time (s)', (4.0, 6.0))]),
+    ('spectrogram pan', 7, [('slider', 'Time (s)', (4.5, 6.5))]),
+    ('spectrogram whitened', 7, [('radio', 'Signal', 'Whitened maze')]),
+    ('spectrogram gw', 7, [('radio', 'Signal', 'Whitened GW150914 (H1)')]),
+]
+
+
+def _widget(at, kind, label):
+    index = 0
+    if label.endswith(']'):
+        label, index = label[:-1].split('[')
+        index = int(index)
+    matches = [w for w in getattr(at, kind) if w.label == label]
+    return matches[index]
+
+
+def _set(at, kind, label, value):
+    _widget(at, kind, label).set_value(value)
+
+
+def _select(at, section):
+    radio = _widget(at, 'radio', 'Select Section:')
+    radio.set_value(radio.options[section-1])
+
+
+def _rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def _maxrss():
+    # -- ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1 if platform.system() == 'Darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def _timed(at):
+    start = time.perf_counter()
+    at.run()
+    elapsed = time.perf_counter() - start
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    return elapsed
+
+
+def _cachedelta(before, after):
+    return {name: {'hits': after[name]['hits'] - before.get(name, {}).get('hits', 0),
+                   'misses': after[name]['misses'] - before.get(name, {}).get('misses', 0)}
+            for name in after}
+
+
+def run(scenarios=SCENARIOS, repeat=3):
+    at = AppTest.from_file(APP, default_timeout=600)
+    startup = _timed(at)
+    results = []
+    for name, section, widgets in scenarios:
+        before = memo.stats()
+        _select(at, section)
+        navigate = _timed(at)
+        for kind, label, value in widgets:
+            _set(at, kind, label, value)
+        first = _timed(at)
+        warm = [_timed(at) for _ in range(repeat)]
+        results.append({
+            'name': name,
+            'section': section,
+            'widgets': [[kind, label, value] for kind, label, value in widgets],
+            'navigate_s': navigate,
+            'first_s': first,
+            'warm_s': statistics.median(warm) if warm else None,
+            'rss_bytes': _rss(),
+            'maxrss_bytes': _maxrss(),
+            'caches': _cachedelta(before, memo.stats()),
+        })
+        print("{0:24s} first {1:7.3f} s  warm {2:7.3f} s".format(
+            name, first, results[-1]['warm_s'] or float('nan')))
+    return {'startup_s': startup, 'scenarios': results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='warm reruns per scenario')
+    parser.add_argument('--output', default='bench_results.json',
+                        help='where to write the JSON results')
+    parser.add_argument('--only', action='append',
+                        help='run only the named scenario (may be repeated)')
+    parser.add_argument('--quality', default='full', choices=quality.TIERS + ('auto',),
+                        help='quality tier to render at (see quality.py)')
+    args = parser.parse_args()
+
+    quality.MODE = args.quality
+
+    scenarios = [s for s in SCENARIOS if not args.only or s[0] in args.only]
+    with gwoscfixture.offline():
+        report = run(scenarios, args.repeat)
+    report.update({
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'repeat': args.repeat,
+        'quality': args.quality,
+    })
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print("Wrote {0}".format(args.output))
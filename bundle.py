@@ -0,0 +1,258 @@
+# -- Prebuilt arrays, plots and audio for the sections that always show
+# -- the same thing, memory mapped from ASSET_BUNDLE.  A missing or stale
+# -- bundle is ignored and the assets are computed live.
+# --     python bundle.py            #-- build (audio in AUDIO_CODEC)
+# --     python bundle.py --verify   #-- check every file against the manifest
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import sys
+import threading
+import time
+from functools import lru_cache
+from importlib import metadata
+
+import numpy as np
+from gwpy.timeseries import TimeSeries
+
+import metrics
+
+# -- Change when the layout of the bundle changes
+BUNDLE_VERSION = 2
+ASSET_BUNDLE = os.environ.get(
+    'ASSET_BUNDLE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets'))
+
+# -- Files the arrays and payloads are built from, including the code
+# -- that builds and draws them, and the libraries that code uses: the
+# -- bundle is stale if any of them change
+INPUTS = ('LOZ_Secret.wav', 'helper.py', 'noisegen.py', 'precision.py', 'spectra.py',
+          'filters.py', 'filterbank.py', 'pipelines.py', 'tiles.py', 'plots.py', 'audio.py')
+LIBRARIES = ('numpy', 'scipy', 'gwpy', 'matplotlib', 'soundfile')
+
+_lock = threading.Lock()
+_state = None    #-- (manifest, payload mmap), or False when there is no usable bundle
+
+
+def _here(name):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+
+
+def _sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _version(library):
+    try:
+        return metadata.version(library)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+@lru_cache(maxsize=1)
+def inputs():
+    # -- {file: sha256, library: version} for everything the assets depend
+    # -- on.  The shared store keys its arrays on this as well
+    found = {name: _sha256(_here(name)) for name in INPUTS}
+    found.update((name, _version(name)) for name in LIBRARIES)
+    return found
+
+
+def _open(path):
+    # -- The manifest and payload map of the bundle at path, or None with
+    # -- the reason it cannot be used
+    try:
+        with open(os.path.join(path, 'manifest.json')) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None, 'missing'
+    if manifest.get('version') != BUNDLE_VERSION or manifest.get('inputs') != inputs():
+        return None, 'stale'
+    payloads = None
+    if manifest['payloads']['size']:
+        try:
+            with open(os.path.join(path, 'payloads.bin'), 'rb') as f:
+                payloads = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None, 'missing'
+        if len(payloads) != manifest['payloads']['size']:
+            return None, 'stale'
+    return (manifest, payloads), None
+
+
+def _bundle():
+    global _state
+    with _lock:
+        if _state is None:
+            _state, reason = _open(ASSET_BUNDLE)
+            if _state is None:
+                metrics.count('bundle', reason)
+                _state = False
+        return _state
+
+
+def reset():
+    # -- Forget the bundle, so the next use opens ASSET_BUNDLE again
+    global _state
+    with _lock:
+        _state = None
+
+
+def load(name, params):
+    # -- {name: read-only TimeSeries} of the set of arrays name, memory
+    # -- mapped from the bundle, or None if the bundle has no such set
+    # -- built with params
+    state = _bundle()
+    if not state:
+        return None
+    entry = state[0]['sets'].get(name)
+    if entry is None or entry['params'] != repr(params):
+        metrics.count('bundle', 'stale')
+        return None
+    try:
+        arrays = {key: np.load(os.path.join(ASSET_BUNDLE, m['file']), mmap_mode='r')
+                  for key, m in entry['arrays'].items()}
+    except (OSError, ValueError):
+        metrics.count('bundle', 'missing')
+        return None
+    if any(list(arrays[key].shape) != m['shape'] or arrays[key].dtype.str != m['dtype']
+           for key, m in entry['arrays'].items()):
+        metrics.count('bundle', 'stale')
+        return None
+    metrics.count('bundle', 'load')
+    return {key: TimeSeries(arrays[key], t0=m['t0'], sample_rate=m['sample_rate'],
+                            unit=m['unit'], name=m['name'], copy=False)
+            for key, m in entry['arrays'].items()}
+
+
+def payload(cache, key):
+    # -- The bytes stored for key of the named ByteLRU, or None
+    state = _bundle()
+    if not state:
+        return None
+    manifest, payloads = state
+    where = manifest['payloads']['index'].get(cache, {}).get(repr(key))
+    if where is None:
+        return None
+    metrics.count('bundle', 'payload')
+    offset, size = where
+    return payloads[offset:offset+size]
+
+
+# -- Building
+
+def _writeset(path, name, params, series):
+    arrays = {}
+    for key, value in series.items():
+        data = np.asarray(value.value)
+        filename = '{0}-{1}.npy'.format(name, key)
+        np.save(os.path.join(path, filename), data)
+        arrays[key] = {'file': filename, 'shape': list(data.shape), 'dtype': data.dtype.str,
+                       't0': value.t0.value, 'sample_rate': value.sample_rate.value,
+                       'unit': str(value.unit), 'name': value.name}
+    return {'params': repr(params), 'arrays': arrays}
+
+
+def _tour():
+    # -- Show each fixed section at its defaults, for both volumes, so the
+    # -- plots and audio they use are rendered into the caches
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(_here('app.py'), default_timeout=600)
+    at.run()
+    for volume in ('Default', 'Louder'):
+        at.sidebar.radio[0].set_value(volume)
+        for section in (1, 2, 3, 4):
+            radio = [w for w in at.radio if w.label == 'Select Section:'][0]
+            radio.set_value(radio.options[section-1]).run()
+        [w for w in at.checkbox if w.label == 'Need a hint?'][0].check().run()
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+
+
+def build(path=ASSET_BUNDLE):
+    # -- Into a scratch directory first, renamed into place when complete
+    global ASSET_BUNDLE
+    import audio, helper, plots, quality
+
+    # -- The ByteLRU caches whose entries are stored as payloads, under the
+    # -- names payload() is asked for
+    caches = {'plots': plots.cache, 'wav': audio.wavcache, 'clips': audio.clipcache}
+
+    tmp = '{0}.tmp-{1}'.format(path, os.getpid())
+    os.makedirs(tmp)
+    manifest = {'version': BUNDLE_VERSION, 'inputs': inputs(),
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'audio_codec': audio.CODEC,
+                'sets': {}, 'payloads': {'size': 0, 'index': {}}, 'files': {}}
+    params = helper.scenarioparams(helper.FS, helper.NOISEDT)
+    manifest['sets']['scenario'] = _writeset(
+        tmp, 'scenario', params, helper._buildscenario(*params[2:6]))
+    manifest['sets']['target'] = _writeset(
+        tmp, 'target', helper.targetparams(), {'signal': helper.buildtarget()})
+    with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+
+    # -- Render from the arrays as the app will map them, so the cache keys
+    # -- (which include a digest of the data) match, and at full quality
+    # -- whatever the load while building
+    ASSET_BUNDLE, mode, quality.MODE = tmp, quality.MODE, 'full'
+    reset()
+    try:
+        for cache in caches.values():
+            cache.clear()
+        _tour()
+        with open(os.path.join(tmp, 'payloads.bin'), 'wb') as f:
+            for name, cache in caches.items():
+                index = manifest['payloads']['index'][name] = {}
+                for key, value in cache.items():
+                    index[repr(key)] = [f.tell(), len(value)]
+                    f.write(value)
+            manifest['payloads']['size'] = f.tell()
+    finally:
+        ASSET_BUNDLE, quality.MODE = path, mode
+        reset()
+
+    for filename in sorted(os.listdir(tmp)):
+        if filename != 'manifest.json':
+            manifest['files'][filename] = _sha256(os.path.join(tmp, filename))
+    with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    if os.path.exists(path):
+        old = '{0}.old-{1}'.format(path, os.getpid())
+        os.rename(path, old)
+        shutil.rmtree(old)
+    os.rename(tmp, path)
+    return manifest
+
+
+def verify(path=ASSET_BUNDLE):
+    # -- Names of the files that do not match the manifest, and the reason
+    # -- the bundle would not be used (None if it would)
+    with open(os.path.join(path, 'manifest.json')) as f:
+        manifest = json.load(f)
+    bad = [name for name, sha in manifest['files'].items()
+           if not os.path.exists(os.path.join(path, name))
+           or _sha256(os.path.join(path, name)) != sha]
+    return bad, _open(path)[1]
+
+
+if __name__ == '__main__':
+    # -- The app modules import this file as bundle, not __main__: build
+    # -- through that module so they see the scratch bundle
+    import bundle
+    if '--verify' in sys.argv[1:]:
+        bad, reason = bundle.verify()
+        for name in bad:
+            print("Does not match manifest: {0}".format(name))
+        if reason:
+            print("Bundle is {0}".format(reason))
+        sys.exit(1 if bad or reason else 0)
+    manifest = bundle.build()
+    print("Built {0}: {1} sets, {2} payloads, {3:.1f} MB of payloads".format(
+        bundle.ASSET_BUNDLE, len(manifest['sets']),
+        sum(len(index) for index in manifest['payloads']['index'].values()),
+        manifest['payloads']['size'] / 2**20))
@@ -0,0 +1,59 @@
+"""Cold start budget check.
+
+Runs the first render of app.py (the default section) headlessly in a
+fresh interpreter and fails if it takes longer than the budget::
+
+    python coldstart.py [budget seconds]
+
+The budget defaults to COLDSTART_BUDGET from the environment, or
+DEFAULT_BUDGET.  Modules that only later sections need are listed if they
+were imported anyway.
+"""
+import os
+import json
+import subprocess
+import sys
+
+DEFAULT_BUDGET = 6.0
+
+# -- Should not be imported until a section that uses them is opened
+DEFERRED = ['matplotlib.pyplot', 'filters', 'plots', 'spectra', 'filtergrid',
+            'pipelines', 'workers', 'tiles', 'filterbank']
+
+_PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file({app!r}, default_timeout=600)
+at.run()
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    'seconds': elapsed,
+    'exception': [e.message for e in at.exception],
+    'deferred': [name for name in {deferred!r} if name in sys.modules],
+}}))
+'''
+
+
+def measure():
+    app = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+    probe = _PROBE.format(app=app, deferred=DEFERRED)
+    out = subprocess.run([sys.executable, '-c', probe], capture_output=True,
+                         text=True, check=True, cwd=os.path.dirname(app))
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        budget = float(sys.argv[1])
+    else:
+        budget = float(os.environ.get('COLDSTART_BUDGET', DEFAULT_BUDGET))
+    result = measure()
+
+    print("Cold start: {0:.2f} s (budget {1:.2f} s)".format(result['seconds'], budget))
+    if result['deferred']:
+        print("Imported before needed: {0}".format(', '.join(result['deferred'])))
+    if result['exception']:
+        print("App raised: {0}".format(result['exception']))
+    if result['exception'] or result['deferred'] or result['seconds'] > budget:
+        sys.exit(1)
@@ -0,0 +1,133 @@
+# -- GWOSC event catalog and concurrent strain loading: every detector of
+# -- an event is loaded at once on the 'io' pool, and the next events are
+# -- prefetched.  The catalog falls back to GWTC-1 when GWOSC cannot be
+# -- reached.  `python events.py` fetches every event before deploying
+import json
+import os
+import time
+from concurrent.futures import wait
+from functools import lru_cache
+
+import metrics
+import strainstore
+import workers
+
+CATALOG = 'GWTC-1-confident'
+WINDOW = 14      #-- Seconds of strain either side of the event
+PREFETCH = 2     #-- Events after the current one to fetch in the background
+RETRY = 300      #-- Seconds before asking GWOSC again after it failed
+
+# -- (name, gps, detectors) of the confident GWTC-1 events
+GWTC1 = [
+    ('GW150914', 1126259462.4, ('H1', 'L1')),
+    ('GW151012', 1128678900.4, ('H1', 'L1')),
+    ('GW151226', 1135136350.6, ('H1', 'L1')),
+    ('GW170104', 1167559936.6, ('H1', 'L1')),
+    ('GW170608', 1180922494.5, ('H1', 'L1')),
+    ('GW170729', 1185389807.3, ('H1', 'L1', 'V1')),
+    ('GW170809', 1186302519.8, ('H1', 'L1', 'V1')),
+    ('GW170814', 1186741861.5, ('H1', 'L1', 'V1')),
+    ('GW170817', 1187008882.4, ('H1', 'L1', 'V1')),
+    ('GW170818', 1187058327.1, ('H1', 'L1', 'V1')),
+    ('GW170823', 1187529256.5, ('H1', 'L1')),
+]
+
+
+def _path():
+    return os.path.join(strainstore.STRAIN_STORE, 'catalog-{0}.json'.format(CATALOG))
+
+
+def fetch_catalog(catalog=CATALOG):
+    # -- [(name, gps, detectors)] from the GWOSC event API
+    from gwosc import datasets
+
+    events = []
+    for name in datasets.find_datasets(type='events', catalog=catalog):
+        events.append((name.split('-v')[0], datasets.event_gps(name),
+                       tuple(sorted(datasets.event_detectors(name)))))
+    return sorted(events, key=lambda event: event[1])
+
+
+_catalog = None   #-- (catalog, when to ask GWOSC again or None)
+
+
+def catalog():
+    # -- {name: (gps, detectors)}, in time order.  From the copy in the
+    # -- strain store when there is one, otherwise from GWOSC (and keep it).
+    # -- The GWTC-1 fallback is only used for RETRY seconds
+    global _catalog
+    if _catalog is not None and (_catalog[1] is None or time.monotonic() < _catalog[1]):
+        return _catalog[0]
+    retry = None
+    try:
+        with open(_path()) as f:
+            events = json.load(f)
+    except (OSError, ValueError):
+        try:
+            events = fetch_catalog()
+        except Exception:
+            metrics.count('catalog', 'fallback')
+            events, retry = GWTC1, time.monotonic() + RETRY
+        else:
+            try:
+                os.makedirs(strainstore.STRAIN_STORE, exist_ok=True)
+                with open(_path() + '.tmp', 'w') as f:
+                    json.dump(events, f)
+                os.replace(_path() + '.tmp', _path())
+            except OSError:
+                metrics.count('strain_store', 'unwritable')   #-- Keep it in memory only
+    _catalog = ({name: (gps, tuple(detectors)) for name, gps, detectors in events}, retry)
+    return _catalog[0]
+
+
+def reset():
+    # -- Forget the catalog, so the next call reads or fetches it again
+    global _catalog
+    _catalog = None
+
+
+@metrics.cachestats('segment')
+@lru_cache(maxsize=16)
+def segment(detector, gps):
+    # -- The strain around an event, as the section uses it
+    metrics.miss('segment')
+    center = int(gps)
+    strain = strainstore.load(detector, gps-WINDOW, gps+WINDOW)
+    return strain.crop(center-WINDOW, center+WINDOW)
+
+
+def _segment(detector, gps, check):
+    check('load')
+    return segment(detector, gps)
+
+
+def submit(detector, gps):
+    # -- Load one segment on the io pool, shared with anyone else loading it
+    return workers.submit(('segment', detector, gps), _segment, detector, gps,
+                          pool='io')
+
+
+def load(name, detectors=None):
+    # -- {detector: strain} for an event, all segments loaded concurrently
+    gps, available = catalog()[name]
+    jobs = {detector: submit(detector, gps) for detector in detectors or available}
+    wait([job.future for job in jobs.values()])
+    return {detector: job.future.result() for detector, job in jobs.items()}
+
+
+def prefetch(name, count=PREFETCH):
+    # -- Start loading the events after name that are not stored yet
+    names = list(catalog())
+    for following in names[names.index(name)+1:][:count]:
+        gps, detectors = catalog()[following]
+        for detector in detectors:
+            if not strainstore.exists(detector, gps-WINDOW, gps+WINDOW):
+                submit(detector, gps)
+
+
+if __name__ == '__main__':
+    jobs = [(name, detector, submit(detector, gps))
+            for name, (gps, detectors) in catalog().items() for detector in detectors]
+    for name, detector, job in jobs:
+        job.future.result()
+        print("Have {0} {1}".format(name, detector))
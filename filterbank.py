@@ -0,0 +1,79 @@
+# -- A bank of highpass filters scored at once in the frequency domain:
+# -- the gains of every cutoff, on the frequency grid of the maze's ASD,
+# -- are applied to the noise power and the secret sound's energy
+# -- spectrum with one matrix product
+import numpy as np
+from scipy import fft
+
+import filters
+import precision
+import spectra
+from memo import ByteLRU, digest
+
+FILTERBANK_CACHE_BYTES = 16 * 2**20
+cache = ByteLRU(FILTERBANK_CACHE_BYTES, name='filterbank')
+
+
+def gains(kind, fs, cutoffs, frequencies):
+    # -- |H(f)|^2 of the zero-phase filter for each cutoff, one row each.
+    # -- The second-order sections of all the designs are evaluated
+    # -- together, one section index at a time
+    cutoffs = tuple(cutoffs)
+
+    def compute():
+        designs = [filters.design(kind, float(fs), cutoff) for cutoff in cutoffs]
+        nsections = max(len(sos) for sos in designs)
+        identity = [1, 0, 0, 1, 0, 0]
+        sos = np.array([np.vstack([d] + [identity] * (nsections - len(d))) for d in designs])
+        z = np.exp(-2j * np.pi * np.asarray(frequencies, dtype=np.float64) / fs)
+        h = np.ones((len(cutoffs), len(z)), dtype=complex)
+        for section in sos.transpose(1, 0, 2):
+            b, a = section[:, :3, None], section[:, 3:, None]
+            h *= (b[:, 0] + b[:, 1]*z + b[:, 2]*z**2) / (a[:, 0] + a[:, 1]*z + a[:, 2]*z**2)
+        return np.abs(h)**2
+
+    return cache.get_or_compute(('filterbank_gains', kind, float(fs), cutoffs,
+                                 digest(np.asarray(frequencies))),
+                                compute, 'filterbank_gains')
+
+
+def energy(series, frequencies):
+    # -- One-sided energy spectral density of series, summed into bins
+    # -- centred on frequencies (evenly spaced from 0).  Sums to the
+    # -- energy of series
+    def compute():
+        data = np.asarray(series.value, dtype=np.float64)
+        dt = series.dt.decompose().value
+        esd = 2 * np.abs(fft.rfft(data))**2 * dt / len(data)
+        esd[0] /= 2
+        if len(data) % 2 == 0:
+            esd[-1] /= 2
+        df = frequencies[1] - frequencies[0]
+        bins = np.rint(fft.rfftfreq(len(data), dt) / df).astype(int)
+        keep = bins < len(frequencies)
+        return np.bincount(bins[keep], weights=esd[keep], minlength=len(frequencies))
+
+    return cache.get_or_compute(('filterbank_energy', digest(series),
+                                 digest(np.asarray(frequencies))),
+                                compute, 'filterbank_energy')
+
+
+def highpass_snr(maze, secret, cutoffs, fftlength=1):
+    # -- Signal-to-noise ratio (dB) of the secret in the highpassed maze
+    # -- for each cutoff: the secret's mean power while it plays over the
+    # -- noise power.  The noise comes from the maze's median-averaged ASD,
+    # -- which the few seconds of secret barely move
+    cutoffs = tuple(cutoffs)
+
+    def compute():
+        noise = precision.real(spectra.asd(maze, fftlength), 'float64')
+        frequencies = noise.frequencies.value
+        power = np.stack([energy(secret, frequencies) / secret.duration.decompose().value,
+                          noise.value**2 * noise.df.decompose().value])
+        fs = maze.sample_rate.decompose().value
+        signal, noise = (gains('highpass', fs, cutoffs, frequencies)**2 @ power.T).T
+        return 10 * np.log10(signal / noise)
+
+    return cache.get_or_compute(('filterbank_snr', digest(maze), digest(secret),
+                                 cutoffs, fftlength),
+                                compute, 'filterbank_snr')
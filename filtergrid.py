@@ -0,0 +1,184 @@
+# -- Precomputed page 6 filter results: for a coarse grid of band-pass
+# -- cutoffs, with and without whitening, the plotted window and audio
+# -- clip are stored next to the strain.  Other cutoffs filter only the
+# -- clip plus the filters' settling time either side of it.
+# --     python filtergrid.py           #-- build, after warming the strain store
+# --     python filtergrid.py --check   #-- compare with filtering whole segments
+import json
+import os
+import sys
+
+import numpy as np
+from gwpy.timeseries import TimeSeries
+
+import events
+import filters
+import metrics
+import strainstore
+from memo import digest
+
+LOWS = (1, 10, 20, 30, 40, 50, 60, 80, 100, 150, 200, 300, 400, 600, 800, 1000)
+HIGHS = (50, 100, 150, 200, 250, 300, 350, 400, 500, 600, 800, 1000, 1200)
+PLOT_WINDOW = 0.1    #-- Seconds either side of t0 in the time series plot
+AUDIO_WINDOW = 1     #-- Seconds either side of t0 in the audio clip
+WHITEN_FDURATION = 2   #-- Seconds, the TimeSeries.whiten default
+GRID_VERSION = 2       #-- Change when entries are computed differently
+ROI_STEP = 0.25        #-- Region padding is rounded up to this, to share regions
+
+# -- Events to build: (detector, gps time)
+EVENTS = [
+    ('H1', strainstore.GW150914),
+    ('L1', strainstore.GW150914),
+]
+
+
+def _base(detector, t0):
+    return os.path.join(strainstore.STRAIN_STORE,
+                        'grid-{0}-{1!r}'.format(detector, float(t0)))
+
+
+def whiten(strain):
+    # -- Page 6 whitening: the TimeSeries.whiten defaults
+    return filters.whiten(strain)
+
+
+def region(strain, t0, makewhite, low, high):
+    # -- The part of strain (whitened if makewhite) that the audio clip
+    # -- depends on: the clip, plus the settling time of the filters either
+    # -- side.  Band-passing it gives the same windows as band-passing the
+    # -- whole segment, with work that scales with the clip
+    rate = float(strain.sample_rate.value)
+    pad = filters.settling('bandpass', rate, low, high)
+    if makewhite:
+        pad += WHITEN_FDURATION
+    pad = np.ceil(pad / ROI_STEP) * ROI_STEP
+    start = max(t0 - AUDIO_WINDOW - pad, strain.span[0])
+    end = min(t0 + AUDIO_WINDOW + pad, strain.span[1])
+    if not makewhite:
+        return strain.crop(start, end)
+    if (start, end) == tuple(strain.span):
+        return whiten(strain)
+    return filters.whiten_region(strain, start, end, fduration=WHITEN_FDURATION)
+
+
+def windows(bp_data, t0):
+    return (bp_data.crop(t0-PLOT_WINDOW, t0+PLOT_WINDOW),
+            bp_data.crop(t0-AUDIO_WINDOW, t0+AUDIO_WINDOW))
+
+
+def process(strain, t0, makewhite, low, high):
+    # -- Live version of a grid entry: (plot window, audio clip)
+    data = region(strain, t0, makewhite, low, high)
+    return windows(filters.bandpass(data, low, high), t0)
+
+
+def build(strain, detector, t0):
+    # -- Filters are applied directly rather than through the filters cache,
+    # -- which would only churn while sweeping the grid
+    plot, audio = windows(strain, t0)
+    shape = (2, len(LOWS), len(HIGHS))
+    plots = np.full(shape + (len(plot),), np.nan, dtype=strain.dtype)
+    audios = np.full(shape + (len(audio),), np.nan, dtype=strain.dtype)
+    valid = np.zeros(shape, dtype=bool)
+    rate = float(strain.sample_rate.value)
+
+    for w, data in enumerate([strain, whiten(strain)]):
+        for i, low in enumerate(LOWS):
+            for j, high in enumerate(HIGHS):
+                if low >= high:
+                    continue
+                bp_data = filters.apply(data, filters.design('bandpass', rate, low, high))
+                plots[w, i, j], audios[w, i, j] = windows(bp_data, t0)
+                valid[w, i, j] = True
+
+    base = _base(detector, t0)
+    os.makedirs(strainstore.STRAIN_STORE, exist_ok=True)
+    for name, array in [('plot', plots), ('audio', audios), ('valid', valid)]:
+        with open('{0}-{1}.tmp.npy'.format(base, name), 'wb') as f:
+            np.save(f, array)
+        os.replace('{0}-{1}.tmp.npy'.format(base, name), '{0}-{1}.npy'.format(base, name))
+    meta = {
+        'version': GRID_VERSION,
+        'strain': digest(strain),
+        'lows': LOWS,
+        'highs': HIGHS,
+        'sample_rate': rate,
+        'plot_t0': plot.t0.value,
+        'audio_t0': audio.t0.value,
+        'unit': str(strain.unit),
+    }
+    with open(base + '.tmp.json', 'w') as f:
+        json.dump(meta, f)
+    os.replace(base + '.tmp.json', base + '.json')
+    _opened.pop((detector, t0), None)
+
+
+# -- (detector, t0) -> (meta, arrays) of the grids opened so far.  A grid
+# -- that is missing is not remembered, so one built later is picked up
+_opened = {}
+
+
+def _open(detector, t0):
+    index = _opened.get((detector, t0))
+    if index is not None:
+        return index
+    base = _base(detector, t0)
+    try:
+        with open(base + '.json') as f:
+            meta = json.load(f)
+        arrays = {name: np.load('{0}-{1}.npy'.format(base, name), mmap_mode='r')
+                  for name in ('plot', 'audio', 'valid')}
+    except (OSError, ValueError):
+        return None
+    index = _opened[(detector, t0)] = (meta, arrays)
+    return index
+
+
+def lookup(strain, detector, t0, makewhite, low, high):
+    # -- (plot window, audio clip) from the grid, or None when the cutoffs
+    # -- are off the grid or the grid was built from different strain
+    index = _open(detector, t0)
+    if index is None:
+        metrics.count('filtergrid', 'missing')
+        return None
+    meta, arrays = index
+    if low not in meta['lows'] or high not in meta['highs']:
+        metrics.count('filtergrid', 'miss')
+        return None
+    w, i, j = int(bool(makewhite)), meta['lows'].index(low), meta['highs'].index(high)
+    if (not arrays['valid'][w, i, j] or meta.get('version') != GRID_VERSION
+            or meta['strain'] != digest(strain)):
+        metrics.count('filtergrid', 'miss')
+        return None
+    metrics.count('filtergrid', 'hit')
+    return (TimeSeries(arrays['plot'][w, i, j], t0=meta['plot_t0'], unit=meta['unit'],
+                       sample_rate=meta['sample_rate'], copy=False),
+            TimeSeries(arrays['audio'][w, i, j], t0=meta['audio_t0'], unit=meta['unit'],
+                       sample_rate=meta['sample_rate'], copy=False))
+
+
+def check(strain, t0):
+    # -- Largest difference between process() and filtering the whole
+    # -- segment, over the grid, relative to the RMS of the audio clip
+    worst = 0
+    rate = float(strain.sample_rate.value)
+    for w, data in enumerate([strain, whiten(strain)]):
+        for low in LOWS:
+            for high in [high for high in HIGHS if high > low]:
+                sos = filters.design('bandpass', rate, low, high)
+                _, full = windows(filters.apply(data, sos), t0)
+                _, clip = process(strain, t0, bool(w), low, high)
+                worst = max(worst, np.max(np.abs(clip.value - full.value))
+                            / np.sqrt(np.mean(np.square(full.value))))
+    return worst
+
+
+if __name__ == '__main__':
+    if '--check' in sys.argv[1:]:
+        for detector, t0 in EVENTS:
+            print("{0}: largest difference {1:.1e} of RMS".format(
+                detector, check(events.segment(detector, t0), t0)))
+        sys.exit()
+    for detector, t0 in EVENTS:
+        build(events.segment(detector, t0), detector, t0)
+        print("Built {0}".format(os.path.basename(_base(detector, t0))))
@@ -0,0 +1,164 @@
+from functools import lru_cache
+
+import numpy as np
+from scipy import signal
+from gwpy.signal import filter_design
+
+import metrics
+import precision
+import spectra
+from memo import ByteLRU, digest
+
+# -- Filtered outputs shared by every session, bounded by total bytes
+FILTER_CACHE_BYTES = 256 * 2**20
+cache = ByteLRU(FILTER_CACHE_BYTES, name='filters')
+
+# -- A filter has settled once what is left of its impulse response is
+# -- below this fraction of the whole (in amplitude)
+SETTLE_TOLERANCE = 1e-5
+SETTLE_MAX = 32     #-- Seconds
+
+
+# -- Design the second-order sections once per (type, fs, cutoffs).
+# -- Uses the same gwpy design and conversion path as TimeSeries.highpass
+# -- and TimeSeries.bandpass, so the results match those methods
+@lru_cache(maxsize=512)
+def design(kind, fs, *cutoffs):
+    if kind == 'highpass':
+        zpk = filter_design.highpass(cutoffs[0], fs, analog=False)
+    elif kind == 'bandpass':
+        zpk = filter_design.bandpass(cutoffs[0], cutoffs[1], fs, analog=False)
+    else:
+        raise ValueError("Unknown filter type '{0}'".format(kind))
+    _, zpk = filter_design.parse_filter(zpk)
+    sos = signal.zpk2sos(*zpk)
+    return sos
+
+
+@lru_cache(maxsize=512)
+def settling(kind, fs, *cutoffs):
+    # -- Seconds it takes design(kind, fs, *cutoffs) to forget its input,
+    # -- at most SETTLE_MAX.  Filtering a span padded by this much either
+    # -- side matches filtering the whole series over that span
+    impulse = np.zeros(int(SETTLE_MAX * fs))
+    impulse[0] = 1
+    response = signal.sosfilt(design(kind, fs, *cutoffs), impulse)
+    tail = np.cumsum(response[::-1]**2)[::-1]
+    settled = np.flatnonzero(tail < SETTLE_TOLERANCE**2 * tail[0])
+    return (settled[0] if len(settled) else len(impulse)) / fs
+
+
+def apply(series, sos):
+    # -- Zero-phase filter, formatted like TimeSeries.filter output.
+    # -- The recursion runs in double (float32 coefficients are not stable
+    # -- enough at low cutoffs) and the output keeps the input's dtype
+    out = precision.match(signal.sosfiltfilt(sos, series, axis=0), series)
+    new = out.view(type(series))
+    new.__metadata_finalize__(series)
+    new._unit = series.unit
+    return new
+
+
+def _cached(series, key, compute):
+    # -- key is (stage, parameters...), for the output of series
+    return cache.get_or_compute((digest(series),) + key, compute, key[0])
+
+
+def _rate(series):
+    return float(series.sample_rate.to('Hz').value)
+
+
+def highpass(series, frequency):
+    sos = design('highpass', _rate(series), frequency)
+    return _cached(series, ('highpass', frequency),
+                   lambda: apply(series, sos))
+
+
+def bandpass(series, flow, fhigh):
+    sos = design('bandpass', _rate(series), flow, fhigh)
+    return _cached(series, ('bandpass', flow, fhigh),
+                   lambda: apply(series, sos))
+
+
+def bandpass_many(series, flow, fhigh):
+    # -- Band-pass several series of the same rate and length (the
+    # -- detectors of one event) with one sosfiltfilt over the stacked
+    # -- data.  Results are cached under the same keys as bandpass()
+    keys = [(digest(s), 'bandpass', flow, fhigh) for s in series]
+    results = [cache.get(key) for key in keys]
+    todo = [i for i, result in enumerate(results) if result is None]
+    if not todo:
+        return results
+    if len({(_rate(series[i]), len(series[i])) for i in todo}) > 1:
+        raise ValueError("bandpass_many needs series of one rate and length")
+    sos = design('bandpass', _rate(series[todo[0]]), flow, fhigh)
+    with metrics.stage('bandpass') as record:
+        stacked = np.stack([np.asarray(series[i].value) for i in todo])
+        out = precision.match(signal.sosfiltfilt(sos, stacked, axis=-1), series[todo[0]])
+        record.nbytes = out.nbytes
+    for row, i in zip(out, todo):
+        new = row.view(type(series[i]))
+        new.__metadata_finalize__(series[i])
+        new._unit = series[i].unit
+        new.flags.writeable = False   #-- Shared, so read-only
+        results[i] = cache.put(keys[i], new)
+    return results
+
+
+def whitening_asd(series, fftlength=None, overlap=0):
+    # -- The shared ASD whiten() divides series by
+    if fftlength is None:
+        fftlength = spectra.default_fftlength(series)
+    return spectra.asd(series, fftlength, overlap)
+
+
+def whiten(series, fftlength=None, overlap=0):
+    # -- Whiten with the shared ASD from spectra, so a page that also uses
+    # -- that ASD only estimates it once.  Computed in double like apply()
+    if fftlength is None:
+        fftlength = spectra.default_fftlength(series)
+
+    def compute():
+        spectrum = precision.real(whitening_asd(series, fftlength, overlap), 'float64')
+        white = precision.real(series, 'float64').whiten(fftlength, overlap=overlap,
+                                                         asd=spectrum)
+        return precision.match(white, series)
+
+    return _cached(series, ('whiten', fftlength, overlap), compute)
+
+
+def _whitening_fir(series, fftlength, overlap, fduration):
+    # -- The FIR filter TimeSeries.whiten designs for the whole of series,
+    # -- from the shared ASD
+    def compute():
+        spectrum = precision.real(spectra.asd(series, fftlength, overlap), 'float64')
+        spectrum = spectrum.interpolate(1./series.duration.decompose().value)
+        return filter_design.fir_from_transfer(1/spectrum.value,
+                                               ntaps=int(fduration * _rate(series)),
+                                               window='hann', ncorner=0)
+
+    return _cached(series, ('whitening_fir', fftlength, overlap, fduration), compute)
+
+
+def whiten_region(series, start, end, fftlength=None, overlap=0, fduration=2):
+    # -- whiten(series) from start to end, filtering only that span: the
+    # -- same ASD, filter and mean are used, so the result matches except
+    # -- within fduration of start and end (the edges are tapered over
+    # -- fduration/2, and the filter spreads that over another fduration/2)
+    if fftlength is None:
+        fftlength = spectra.default_fftlength(series)
+
+    def compute():
+        fir = _whitening_fir(series, fftlength, overlap, fduration)
+        region = series.crop(start, end).astype('float64')
+        region.value[:] -= np.mean(series.value, dtype='float64')
+        white = region.convolve(fir, window='hann') * np.sqrt(2 * region.dt.decompose().value)
+        return precision.match(white, series)
+
+    return _cached(series, ('whiten_region', fftlength, overlap, fduration, start, end),
+                   compute)
+
+
+def filtered_asd(spectrum, kind, fs, *cutoffs):
+    # -- ASD of highpass/bandpass output, from the input ASD
+    return spectra.filtered(spectrum, design(kind, float(fs), *cutoffs), float(fs))
@@ -1,17 +1,12 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 import altair as alt
 
-import requests, os
-from gwpy.timeseries import TimeSeries
-from gwosc.locate import get_urls
-from gwosc import datasets
-from gwpy.plot import Plot
-from scipy import signal
-
-from helper import makesine, make_audio_file, plot_signal
+import lod
+import metrics
+import quality
+from helper import makesine, play, plot_signal, maketarget, synthesize
 
 cropstart = 1.0
 cropend   = 1.05
@@ -40,14 +35,11 @@ to generate the signal.
 
     st.markdown("#### Target signal in time domain:")
 
-    sig1 = makesine(200, 4, False)
-    sig2 = makesine(250, 3, False)
-    sig3 = makesine(300, 2, False)
-    
-    totalsignal = sig1+sig2+sig3
+    target = maketarget()
+    totalsignal = target['signal']
     plot_signal(totalsignal, color_num=1)
 
-    st.audio(make_audio_file(totalsignal), format='audio/wav')
+    play(totalsignal)
 
     st.markdown("""
     The above plot shows the target signal in the **time domain**.  In a time-domain plot, the x-axis 
@@ -67,11 +59,14 @@ to generate the signal.
     showfreq = st.checkbox('Convert target signal to the frequency domain', value=False)
 
     if showfreq:
-        freqdomain = totalsignal.fft()
+        freqdomain = target['fft']
+        freqs, amps = lod.reduce(freqdomain.frequencies.value,
+                                 np.abs(freqdomain.value), domain=(0, 400),
+                                 budget=int(lod.PIXEL_BUDGET * quality.setting('points')))
 
         source = pd.DataFrame({
-            'Frequency (Hz)': freqdomain.frequencies,
-            'Amplitude': np.abs(freqdomain.value),
+            'Frequency (Hz)': freqs,
+            'Amplitude': amps,
             'color':['#1f77b4', '#ff7f0e'][1]
         })
 
@@ -87,7 +82,8 @@ to generate the signal.
             color=alt.Color('color', scale=None)
         ).properties(title='Target Signal in Frequency Domain')
 
-        st.altair_chart(chart, width='stretch')
+        with metrics.stage('altair'):
+            st.altair_chart(chart, width='stretch')
             
         st.markdown("""
         Converting to the **frequency domain** shows us the individual components that contributed to the total.
@@ -125,12 +121,13 @@ to generate the signal.
 
     st.markdown("### Adding the 3 components together:")
     
-    guess  = guess1 + guess2 + guess3
+    guess  = synthesize([freq1, freq2, freq3], [amp1, amp2, amp3])
 
     chart1 = plot_signal(guess, color_num=0, display=False)
     chart2 = plot_signal(totalsignal, color_num=1, display=False)
     chart = (chart2 + chart1).properties(title='Target Signal (orange) & Guess (blue)')
-    st.altair_chart(chart, width='stretch')
+    with metrics.stage('altair'):
+        st.altair_chart(chart, width='stretch')
         
     mismatch = (totalsignal.crop(cropstart, cropend) - guess.crop(cropstart, cropend)).value.max()
     # st.write(mismatch)
@@ -142,10 +139,10 @@ to generate the signal.
         st.markdown("### That's really close!")    
     
     st.markdown("#### Audio for target signal")
-    st.audio(make_audio_file(totalsignal), format='audio/wav')
+    play(totalsignal)
 
     st.markdown("#### Audio for guess")
-    st.audio(make_audio_file(guess), format='audio/wav')
+    play(guess)
     
     st.markdown("""
     See if you can recreate the target signal, by adjusting the 3 components.  
@@ -157,6 +154,3 @@ to generate the signal.
     When ready, go to the next section using the controls at the 
     top.
     """)
-    
-    # -- Close all open figures
-    plt.close('all')
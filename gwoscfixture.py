@@ -0,0 +1,66 @@
+"""Offline stand-in for GWOSC.
+
+Replaces TimeSeries.fetch_open_data with deterministic synthetic strain
+(Gaussian noise plus a short chirp at the centre of the segment) and the
+event catalog with the built-in GWTC-1 list, and points the strain store
+at a scratch directory, so the Gravitational Wave Data section can be
+benchmarked and load tested without network access::
+
+    with gwoscfixture.offline(latency=0.5):
+        ...
+
+Everything goes through the files of the strain store as it would with
+GWOSC.  latency adds a delay to each download, to see concurrent loading.
+"""
+import contextlib
+import tempfile
+import time
+import zlib
+from unittest import mock
+
+import numpy as np
+from gwpy.timeseries import TimeSeries
+
+import events
+import strainstore
+
+
+def fetch_open_data(detector, start, end, sample_rate=4096, **kwargs):
+    seed = zlib.crc32('{0}-{1!r}'.format(detector, float(start)).encode())
+    rng = np.random.default_rng(seed)
+    nsamp = int(round((end - start) * sample_rate))
+    data = rng.normal(scale=1e-21, size=nsamp)
+
+    # -- A 0.2 s chirp from 35 to 250 Hz, ending at the centre
+    times = np.arange(nsamp) / sample_rate - (end - start) / 2
+    inband = (times > -0.2) & (times <= 0)
+    phase = 2*np.pi * (35*times[inband] + 0.5 * (250-35)/0.2 * (times[inband]+0.2)**2)
+    data[inband] += 5e-22 * np.sin(phase)
+
+    return TimeSeries(data, t0=start, sample_rate=sample_rate, unit='strain',
+                      name='{0}:GWOSC-4KHZ_R1_STRAIN'.format(detector))
+
+
+def _clear():
+    events.reset()
+    events.segment.cache_clear()
+
+
+@contextlib.contextmanager
+def offline(store=None, latency=0):
+    # -- store: directory for the strain store, a scratch directory if None
+    def fetch(cls, *args, **kwargs):
+        time.sleep(latency)
+        return fetch_open_data(*args, **kwargs)
+
+    with contextlib.ExitStack() as stack:
+        if store is None:
+            store = stack.enter_context(tempfile.TemporaryDirectory())
+        stack.enter_context(mock.patch.object(strainstore, 'STRAIN_STORE', store))
+        stack.enter_context(mock.patch.object(TimeSeries, 'fetch_open_data',
+                                              classmethod(fetch)))
+        stack.enter_context(mock.patch.object(events, 'fetch_catalog',
+                                              lambda catalog=None: events.GWTC1))
+        _clear()
+        stack.callback(_clear)
+        yield store
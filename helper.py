@@ -1,62 +1,184 @@
 import streamlit as st
-import gwpy
 from gwpy.timeseries import TimeSeries
-from scipy import signal
 from numpy import random
 import numpy as np
-import io
-from scipy.io import wavfile
-import matplotlib.pyplot as plt
-import altair as alt
-import pandas as pd
+from functools import lru_cache
 
+from audio import encode
+import bundle
+import lod
+import metrics
+import noisegen
+import precision
+import quality
+import sharedstore
 
 
-def make_audio_file(bp_data, t0=None):
-    # -- window data for gentle on/off
-    window = signal.windows.tukey(len(bp_data), alpha=1.0/10)
-    win_data = bp_data*window
+def audio_clip(bp_data, codec=None, maxrate=None):
+    # -- window data for gentle on/off, normalize for 16 bit audio, and
+    # -- encode in codec (audio.CODEC if None), decimated to at most
+    # -- maxrate (full rate if None).  Identical audio is encoded once and
+    # -- the bytes are shared: returns the payload and the format to pass
+    # -- to st.audio
+    return encode(bp_data, codec, alpha=1.0/10, scale=0.9, maxrate=maxrate)
 
-    # -- Normalize for 16 bit audio
-    win_data = np.int16(win_data/np.max(np.abs(win_data)) * 32767 * 0.9)
 
-    fs=1/win_data.dt.value
-    virtualfile = io.BytesIO()    
-    wavfile.write(virtualfile, int(fs), win_data)
-    
-    return virtualfile
+def play(bp_data, codec=None):
+    payload, mimetype = audio_clip(bp_data, codec, quality.setting('audio_rate'))
+    st.audio(payload, format=mimetype)
 
-@st.cache_data(max_entries=5)   #-- Magic command to cache data
-def load_gw(t0, detector):
-    strain = TimeSeries.fetch_open_data(detector, t0-14, t0+14, cache=False)
-    return strain
+# -- Method to make random noise
+def makewhitenoise(fs, dt, seed=None):
+    noise = TimeSeries(precision.real(random.default_rng(seed).normal(scale=.1, size=fs*dt)),
+                       sample_rate=fs)
+    return noise
 
 
-# -- Method to make and cache random noise
-@st.cache_data(max_entries=5)
-def makewhitenoise(fs, dt):
-    noise = TimeSeries(random.normal(scale=.1, size=fs*dt), sample_rate=fs)
-    return noise
+# -- Change when the scenario is built differently, so processes do not
+# -- attach to arrays built by older code
+SCENARIO_VERSION = 1
+
+# -- The scenario the app shows.  The noise is seeded so every process
+# -- (and the prebuilt bundle, see bundle.py) has the same samples
+FS = 32000
+NOISEDT = 8
+NOISE_SEED = 1
+
+
+def _buildscenario(fs, noisedt, volume, seed):
+    noise = makewhitenoise(fs, noisedt, seed)
+
+    #-- Color the noise: 1/f^2 with a 30 Hz cut-off (noisegen.REDNOISE),
+    #-- filtered block by block so any duration and rate will do
+    colorednoise = noisegen.collect(noisegen.color(noisegen.blocks(noise), fs), fs)
+
+    # -- Inject the signal
+    secret = TimeSeries.read('LOZ_Secret.wav')
+
+    # -- Normalize and convert to float
+    secret -= secret.value[0]  #-- Remove constant offset
+    secret = precision.real(secret)
+    secret = secret/np.max(np.abs(secret)) * volume   #-- Set amplitude
+    secret.t0 = 4
+
+    return {
+        'noise': noise,
+        'colorednoise': colorednoise,
+        'secret': secret,
+        'maze-Default': colorednoise.inject(secret),
+        'maze-Louder': colorednoise.inject(10*secret),
+    }
+
+
+def scenarioparams(fs, noisedt, volume=1e-8, seed=NOISE_SEED):
+    return ('makescenario', SCENARIO_VERSION, fs, noisedt, volume, seed, precision.PRECISION)
+
+
+# -- Build the noise + secret sound scenario once per host.  The arrays
+# -- come from the prebuilt bundle when it has them, and otherwise live
+# -- in the shared store (see sharedstore.py), keyed on the code that
+# -- builds them too: the first process builds them, and every process
+# -- maps the same read-only pages.
+# -- cache_resource then hands every rerun the same objects
+@metrics.cachestats('makescenario')
+@st.cache_resource(max_entries=5)
+def makescenario(fs, noisedt, volume=1e-8, seed=NOISE_SEED):
+    metrics.miss('makescenario')
+    params = scenarioparams(fs, noisedt, volume, seed)
+    arrays = (bundle.load('scenario', params)
+              or sharedstore.load(params + (bundle.inputs(),),
+                                  lambda: _buildscenario(fs, noisedt, volume, seed)))
+    return {
+        'noise': arrays['noise'],
+        'colorednoise': arrays['colorednoise'],
+        'secret': arrays['secret'],
+        'maze': {'Default': arrays['maze-Default'], 'Louder': arrays['maze-Louder']},
+    }
+
+
+# -- Sine synthesis: the time base and the unit-amplitude tapered sine
+# -- for each frequency are built once, then scaled and summed in one step
+SINE_RATE = 4096
+SINE_DURATION = 3
+
+
+@lru_cache(maxsize=4)
+def sinetime(fs=SINE_RATE, duration=SINE_DURATION):
+    time = np.arange(0, duration, 1.0/fs)
+    time.flags.writeable = False
+    return time
+
+
+@lru_cache(maxsize=128)
+def unitsine(freq, fs=SINE_RATE, duration=SINE_DURATION):
+    time = sinetime(fs, duration)
+    sig = TimeSeries(np.sin( 2*np.pi*freq*time ), dt=1.0/fs).taper().value
+    sig.flags.writeable = False
+    return sig
+
+
+@lru_cache(maxsize=64)
+def _sinebasis(freqs, fs, duration):
+    basis = np.stack([unitsine(freq, fs, duration) for freq in freqs])
+    basis.flags.writeable = False
+    return basis
+
+
+def synthesize(freqs, amps, fs=SINE_RATE, duration=SINE_DURATION):
+    # -- Sum of amp*sin(2 pi freq t) components as a single matrix product
+    basis = _sinebasis(tuple(freqs), fs, duration)
+    return TimeSeries(np.asarray(amps, dtype=float) @ basis, dt=1.0/fs)
 
 
 def makesine(freq, amp, makeplot=True, cropstart=1.0, cropend=1.05):
-    fs = 4096
-    
-    time = np.arange(0,3, 1.0/fs)
-    y1 = amp*np.sin( 2*np.pi*freq*time )
-    if amp>0:
-        sig1 = TimeSeries(y1, dt=1.0/fs).taper() 
-    else:
-        sig1 = TimeSeries(y1, dt=1.0/fs)
+    sig1 = synthesize([freq], [amp])
     if makeplot:
         plot_signal(sig1)
     return(sig1)
 
-def plot_signal(signal, cropstart=1.0, cropend=1.05, color_num=0, display=True):
+
+# -- The three note target signal never changes, so build it and its FFT
+# -- once per process.  Its audio is encoded per quality tier by play()
+TARGET_FREQS = (200, 250, 300)
+TARGET_AMPS = (4, 3, 2)
+
+
+def targetparams():
+    return ('maketarget', TARGET_FREQS, TARGET_AMPS, SINE_RATE, SINE_DURATION)
+
+
+def buildtarget():
+    return synthesize(TARGET_FREQS, TARGET_AMPS)
+
+
+@metrics.cachestats('maketarget')
+@st.cache_resource
+def maketarget():
+    metrics.miss('maketarget')
+    arrays = bundle.load('target', targetparams())
+    totalsignal = arrays['signal'] if arrays else buildtarget()
+    freqdomain = totalsignal.fft()
+    totalsignal.flags.writeable = False
+    freqdomain.flags.writeable = False
+    return {
+        'signal': totalsignal,
+        'fft': freqdomain,
+    }
+
+def plot_signal(signal, cropstart=1.0, cropend=1.05, color_num=0, display=True,
+                budget=None):
+    # -- altair and pandas are only needed on the first page
+    import altair as alt
+    import pandas as pd
+
+    if budget is None:
+        budget = int(lod.PIXEL_BUDGET * quality.setting('points'))
     crop_signal = signal.crop(cropstart, cropend)
+    times, values = lod.reduce(crop_signal.times.value, crop_signal.value,
+                               budget=budget)
     source = pd.DataFrame({
-        'Time (s)': crop_signal.times,
-        'Pressure': crop_signal.value,
+        'Time (s)': times,
+        'Pressure': values,
         'color':['#1f77b4', '#ff7f0e'][color_num]
     })
 
@@ -68,6 +190,7 @@ def plot_signal(signal, cropstart=1.0, cropend=1.05, color_num=0, display=True):
         )
 
     if display:
-        st.altair_chart(chart, width='stretch')
+        with metrics.stage('altair'):
+            st.altair_chart(chart, width='stretch')
 
     return(chart)
@@ -0,0 +1,458 @@
+"""Concurrent-session load test against local app servers.
+
+Starts one or more Streamlit servers running app.py, with GWOSC replaced by
+the offline stand-in in gwoscfixture.py, and connects simulated students
+to them over the same websocket protocol the browser uses.  Each student
+starts at a random section and works through the rest in order, with a
+think time between actions:
+changing section, dragging the page 4 highpass and page 6 band-pass
+sliders, toggling whitening and switching the secret sound volume.  Images
+and audio are fetched from the media endpoint as a browser would::
+
+    python loadtest.py [--students 20] [--duration 120] [--servers 1]
+                       [--think 1.0] [--output loadtest_results.json]
+
+Reported: reruns per second and per CPU second of the servers, p50, p95
+and p99 rerun latency (overall and per section), the RSS growth and open
+matplotlib figures of each server, and the shared cache hit ratios,
+scraped from each server's /metrics endpoint (see metrics.py).
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import numpy as np
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+SECTIONS = 7
+METRICS_OFFSET = 1000    #-- /metrics of the server on port p is on p + this
+
+# -- What a student does on each section: a list of actions, each a list of
+# -- (widget label, value) set before one rerun.  Values are functions of a
+# -- random generator.  A label ending in [n] picks the n-th widget with
+# -- that label
+VOLUME = ('Secret sound volume', lambda rng: rng.choice(['Default', 'Louder']))
+ACTIONS = {
+    1: [[('Frequency (Hz)[{0}]'.format(i), lambda rng: rng.randrange(100, 401, 10))]
+        for i in range(3)]
+       + [[('Convert target signal to the frequency domain', lambda rng: True)]],
+    2: [[VOLUME]],
+    3: [[VOLUME]],
+    4: [[('High pass filter cutoff frequency (Hz)', lambda rng: rng.randrange(0, 3001, 100))]
+        for _ in range(4)]
+       + [[('Need a hint?', lambda rng: rng.random() < 0.3)]],
+    5: [[('Whiten the data?', lambda rng: True)], [VOLUME],
+        [('Whiten the data?', lambda rng: rng.random() < 0.5)]],
+    6: [[('Band-pass filter cutoff (Hz)', lambda rng: _band(rng))] for _ in range(3)]
+       + [[('Apply whitening', lambda rng: True)],
+          [('Band-pass filter cutoff (Hz)', lambda rng: _band(rng))]],
+    7: [[('Signal', lambda rng: rng.choice(['Maze', 'Highpassed maze', 'Whitened maze']))],
+        [('Time (s)', lambda rng: _span(rng, 0, 8))],
+        [('Time (s)', lambda rng: _span(rng, 0, 8))]],
+}
+
+
+def _band(rng):
+    # -- Half the time the suggested 30-400 Hz, otherwise anywhere
+    if rng.random() < 0.5:
+        return (30, 400)
+    low = rng.randrange(1, 300)
+    return (low, rng.randrange(low + 50, 1201))
+
+
+def _span(rng, start, end):
+    width = rng.choice([0.5, 1, 2, 4])
+    left = round(rng.uniform(start, end - width), 1)
+    return (left, left + width)
+
+
+# -- Servers
+
+def serve(port):
+    # -- Run app.py on port in this process, with GWOSC stubbed out
+    from streamlit.web import bootstrap
+
+    import gwoscfixture
+
+    flags = {
+        'server_port': port,
+        'server_headless': True,
+        'server_fileWatcherType': 'none',
+        'browser_gatherUsageStats': False,
+    }
+    with gwoscfixture.offline(store=os.environ.get('STRAIN_STORE')):
+        bootstrap.load_config_options(flags)
+        bootstrap.run(APP, False, [], flags)
+
+
+def start(port, env):
+    env = dict(env, METRICS_PORT=str(port + METRICS_OFFSET))
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', str(port)],
+                            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_ready(port, process, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("Server on port {0} exited".format(port))
+        try:
+            with urllib.request.urlopen('http://localhost:{0}/_stcore/health'.format(port),
+                                        timeout=1) as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("Server on port {0} did not start".format(port))
+
+
+def rss(pid):
+    with open('/proc/{0}/status'.format(pid)) as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def cpu_seconds(pid):
+    with open('/proc/{0}/stat'.format(pid)) as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def scrape(port):
+    # -- {(metric, label): value} from a server's /metrics
+    url = 'http://localhost:{0}/metrics'.format(port + METRICS_OFFSET)
+    with urllib.request.urlopen(url, timeout=10) as response:
+        text = response.read().decode()
+    samples = {}
+    for line in text.splitlines():
+        match = re.match(r'(\w+)\{(?:\w+="([^"]*)")?\} (\S+)$', line)
+        if match:
+            samples[(match.group(1), match.group(2) or '')] = float(match.group(3))
+    return samples
+
+
+def sample(server):
+    port, process = server
+    return {'rss_bytes': rss(process.pid), 'cpu_s': cpu_seconds(process.pid),
+            'metrics': scrape(port)}
+
+
+# -- Students
+
+class Student:
+
+    def __init__(self, port, rng, think, deadline):
+        self.base = 'http://localhost:{0}'.format(port)
+        self.url = 'ws://localhost:{0}/_stcore/stream'.format(port)
+        self.rng = rng
+        self.think = think
+        self.deadline = deadline
+        self.widgets = {}    #-- label -> [(kind, proto)] in the last run
+        self.values = {}     #-- widget id -> WidgetState
+        self.section = 1
+        self.reruns = []     #-- (section, seconds)
+        self.media = []      #-- seconds per fetch
+        self.errors = []
+
+    async def run(self):
+        import websockets
+
+        async with websockets.connect(self.url, subprotocols=['streamlit'],
+                                      max_size=None) as ws:
+            self.ws = ws
+            await self.rerun()
+            await self.goto(self.rng.randint(1, SECTIONS))
+            while time.monotonic() < self.deadline:
+                for action in ACTIONS[self.section]:
+                    await self.pause()
+                    if time.monotonic() >= self.deadline:
+                        return
+                    for label, value in action:
+                        self.set(label, value(self.rng))
+                    await self.rerun()
+                await self.pause()
+                await self.goto(self.section % SECTIONS + 1)
+
+    async def goto(self, section):
+        self.section = section
+        self.set('Select Section:', self.widget('Select Section:')[1].options[section-1])
+        await self.rerun()
+
+    async def tour(self):
+        # -- Every section once, with its first action: the warm-up
+        import websockets
+
+        async with websockets.connect(self.url, subprotocols=['streamlit'],
+                                      max_size=None) as ws:
+            self.ws = ws
+            await self.rerun()
+            for section in range(1, SECTIONS + 1):
+                await self.goto(section)
+                for label, value in ACTIONS[section][0]:
+                    self.set(label, value(self.rng))
+                await self.rerun()
+
+    async def pause(self):
+        await asyncio.sleep(self.rng.expovariate(1.0 / self.think) if self.think else 0)
+
+    def widget(self, label):
+        index = 0
+        if label.endswith(']'):
+            label, index = label[:-1].split('[')
+            index = int(index)
+        matches = self.widgets.get(label, [])
+        return matches[index] if index < len(matches) else None
+
+    def set(self, label, value):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        found = self.widget(label)
+        if found is None:
+            return
+        kind, proto = found
+        state = WidgetState(id=proto.id)
+        if kind == 'slider':
+            state.double_array_value.data.extend(
+                value if isinstance(value, (tuple, list)) else [value])
+        elif kind == 'checkbox':
+            state.bool_value = bool(value)
+        else:
+            state.string_value = value
+        self.values[proto.id] = state
+
+    async def rerun(self):
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        ids = {proto.id for found in self.widgets.values() for _, proto in found}
+        msg = BackMsg()
+        msg.rerun_script.query_string = ''
+        msg.rerun_script.page_script_hash = ''
+        msg.rerun_script.widget_states.widgets.extend(
+            state for id_, state in self.values.items() if id_ in ids)
+        self.widgets = {}
+        urls = []
+        start = time.perf_counter()
+        await self.ws.send(msg.SerializeToString())
+        while True:
+            forward = ForwardMsg()
+            forward.ParseFromString(await self.ws.recv())
+            kind = forward.WhichOneof('type')
+            if kind == 'script_finished':
+                break
+            if kind != 'delta' or forward.delta.WhichOneof('type') != 'new_element':
+                continue
+            element = forward.delta.new_element
+            etype = element.WhichOneof('type')
+            if etype in ('slider', 'checkbox', 'radio', 'selectbox', 'multiselect'):
+                proto = getattr(element, etype)
+                self.widgets.setdefault(proto.label, []).append((etype, proto))
+            elif etype == 'imgs':
+                urls.extend(img.url for img in element.imgs.imgs)
+            elif etype == 'audio' and element.audio.url:
+                urls.append(element.audio.url)
+            elif etype == 'exception':
+                self.errors.append(element.exception.message)
+        self.reruns.append((self.section, time.perf_counter() - start))
+        for url in urls:
+            if url.startswith('/'):
+                await asyncio.to_thread(self.fetch, self.base + url)
+        self.values = {id_: state for id_, state in self.values.items()
+                       if any(proto.id == id_ for found in self.widgets.values()
+                              for _, proto in found)}
+
+    def fetch(self, url):
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(url, timeout=60) as response:
+                response.read()
+        except OSError as exc:
+            self.errors.append('{0}: {1}'.format(url, exc))
+        self.media.append(time.perf_counter() - start)
+
+
+async def _students(ports, count, think, duration, seed):
+    deadline = time.monotonic() + duration
+    students = [Student(ports[i % len(ports)], random.Random(seed + i), think, deadline)
+                for i in range(count)]
+
+    async def staggered(student):
+        # -- Students arrive over the first few seconds rather than at once
+        await asyncio.sleep(student.rng.uniform(0, min(5, duration / 4)))
+        await student.run()
+
+    await asyncio.gather(*(staggered(s) for s in students))
+    return students
+
+
+async def _warmup(ports, seed):
+    await asyncio.gather(*(Student(p, random.Random(seed), 0, None).tour() for p in ports))
+
+
+def _percentiles(seconds):
+    if not seconds:
+        return {}
+    p50, p95, p99 = np.percentile(seconds, [50, 95, 99])
+    return {'count': len(seconds), 'p50_s': p50, 'p95_s': p95, 'p99_s': p99,
+            'max_s': max(seconds)}
+
+
+def _ratios(before, after):
+    # -- Hit ratio of each shared cache and cached function over the run
+    def delta(metric, label):
+        return after.get((metric, label), 0) - before.get((metric, label), 0)
+
+    ratios = {}
+    for metric, label in after:
+        if metric == 'tutorial_cache_hits_total':
+            hits, misses = delta(metric, label), delta('tutorial_cache_misses_total', label)
+        elif metric == 'tutorial_st_cache_calls_total':
+            calls = delta(metric, label)
+            hits, misses = calls - delta('tutorial_st_cache_misses_total', label), \
+                delta('tutorial_st_cache_misses_total', label)
+        else:
+            continue
+        if hits + misses:
+            ratios[label] = {'hits': hits, 'misses': misses, 'ratio': hits / (hits + misses)}
+    return ratios
+
+
+def _counters(before, after):
+    return {'{0}:{1}'.format(metric[len('tutorial_'):-len('_total')], label):
+            value - before.get((metric, label), 0)
+            for (metric, label), value in after.items()
+            if metric.endswith('_total') and not metric.startswith(('tutorial_stage_',
+                                                                     'tutorial_cache_'))}
+
+
+def run(students=20, duration=120, servers=1, think=1.0, port=8601, seed=0, warmup=True):
+    with tempfile.TemporaryDirectory() as scratch:
+        env = dict(os.environ, STRAIN_STORE=os.path.join(scratch, 'strain'),
+                   SHARED_STORE=os.path.join(scratch, 'shared'))
+        ports = [port + i for i in range(servers)]
+        procs = [start(p, env) for p in ports]
+        try:
+            for p, process in zip(ports, procs):
+                wait_ready(p, process)
+            if warmup:
+                # -- One student through every section on each server, so the
+                # -- run measures steady state rather than first use
+                asyncio.run(_warmup(ports, seed))
+            before = [sample(s) for s in zip(ports, procs)]
+            wall = time.perf_counter()
+            done = asyncio.run(_students(ports, students, think, duration, seed))
+            wall = time.perf_counter() - wall
+            after = [sample(s) for s in zip(ports, procs)]
+        finally:
+            for process in procs:
+                process.terminate()
+            for process in procs:
+                process.wait()
+
+    reruns = [seconds for s in done for _, seconds in s.reruns]
+    cpu = sum(a['cpu_s'] - b['cpu_s'] for a, b in zip(after, before))
+    report = {
+        'students': students,
+        'servers': servers,
+        'think_s': think,
+        'duration_s': wall,
+        'reruns': len(reruns),
+        'reruns_per_s': len(reruns) / wall,
+        'reruns_per_cpu_s': len(reruns) / cpu if cpu else None,
+        'server_cpu_s': cpu,
+        'latency': _percentiles(reruns),
+        'sections': {section: _percentiles([t for s in done for n, t in s.reruns
+                                            if n == section])
+                     for section in range(1, SECTIONS + 1)},
+        'media': _percentiles([t for s in done for t in s.media]),
+        'errors': sorted({e for s in done for e in s.errors}),
+        'processes': [{
+            'port': p,
+            'rss_start_bytes': b['rss_bytes'],
+            'rss_end_bytes': a['rss_bytes'],
+            'rss_growth_bytes': a['rss_bytes'] - b['rss_bytes'],
+            'open_figures': a['metrics'].get(('tutorial_open_figures', ''), 0),
+            'quality_tier': next((tier for (metric, tier), value in a['metrics'].items()
+                                  if metric == 'tutorial_quality_tier' and value), None),
+            'caches': _ratios(b['metrics'], a['metrics']),
+            'counters': _counters(b['metrics'], a['metrics']),
+        } for p, b, a in zip(ports, before, after)],
+    }
+    return report
+
+
+def _print(report):
+    latency = report['latency']
+    print("{0} students, {1} server(s): {2} reruns in {3:.0f} s".format(
+        report['students'], report['servers'], report['reruns'], report['duration_s']))
+    print("  {0:.2f} reruns/s, {1:.2f} reruns per server CPU second".format(
+        report['reruns_per_s'], report['reruns_per_cpu_s'] or float('nan')))
+    if latency:
+        print("  latency p50 {0:.3f} s  p95 {1:.3f} s  p99 {2:.3f} s".format(
+            latency['p50_s'], latency['p95_s'], latency['p99_s']))
+    for section, stats in report['sections'].items():
+        if stats:
+            print("  section {0}: {1:4d} reruns  p50 {2:.3f} s  p95 {3:.3f} s  p99 {4:.3f} s"
+                  .format(section, stats['count'], stats['p50_s'], stats['p95_s'],
+                          stats['p99_s']))
+    for process in report['processes']:
+        print("  port {0}: RSS {1:.0f} -> {2:.0f} MB ({3:+.1f} MB), {4:.0f} open figures".format(
+            process['port'], process['rss_start_bytes'] / 2**20,
+            process['rss_end_bytes'] / 2**20, process['rss_growth_bytes'] / 2**20,
+            process['open_figures']))
+        print("    " + ", ".join("{0} {1:.0%}".format(name, c['ratio'])
+                                 for name, c in sorted(process['caches'].items())))
+        runs = {name.split(':', 1)[1]: n for name, n in process['counters'].items()
+                if name.startswith('quality_runs:')}
+        if sum(runs.values()):
+            print("    quality tier now {0}; reruns {1}".format(
+                process['quality_tier'], ", ".join(
+                    "{0} {1:.0%}".format(tier, n / sum(runs.values()))
+                    for tier, n in sorted(runs.items()))))
+    for error in report['errors']:
+        print("  error: " + error)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--students', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=120,
+                        help='seconds of load after warm-up')
+    parser.add_argument('--servers', type=int, default=1,
+                        help='app processes, students are spread evenly over them')
+    parser.add_argument('--think', type=float, default=1.0,
+                        help='mean seconds between a student\'s actions')
+    parser.add_argument('--port', type=int, default=8601)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-warmup', dest='warmup', action='store_false')
+    parser.add_argument('--output', default='loadtest_results.json')
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve)
+        sys.exit()
+
+    report = run(args.students, args.duration, args.servers, args.think, args.port,
+                 args.seed, args.warmup)
+    report.update({
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    })
+    _print(report)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print("Wrote {0}".format(args.output))
@@ -0,0 +1,39 @@
+import numpy as np
+
+# -- Level of detail for browser charts.  Data is cropped to the visible
+# -- domain, then reduced to at most PIXEL_BUDGET points, so the chart
+# -- payload does not grow with signal length or sample rate
+PIXEL_BUDGET = 1000
+
+
+def crop(x, y, domain):
+    # -- Keep the points inside domain, plus one neighbour on each side
+    # -- so the line still reaches the edge of the plot.  x is sorted
+    lo, hi = domain
+    start = max(np.searchsorted(x, lo, side='left') - 1, 0)
+    stop = min(np.searchsorted(x, hi, side='right') + 1, len(x))
+    return x[start:stop], y[start:stop]
+
+
+def minmax(x, y, budget=PIXEL_BUDGET):
+    # -- Keep the end points and the min and max of each of budget/2 equal
+    # -- buckets, in order, which preserves the visual envelope of the line
+    n = len(y)
+    if n <= budget:
+        return x, y
+    nbucket = max(budget // 2, 1)
+    width = -(-n // nbucket)
+    padded = np.pad(y, (0, nbucket*width - n), mode='edge').reshape(nbucket, width)
+    base = np.arange(nbucket)[:, None] * width
+    lo = base[:, 0] + np.argmin(padded, axis=1)
+    hi = base[:, 0] + np.argmax(padded, axis=1)
+    indx = np.unique(np.minimum(np.concatenate([[0], lo, hi, [n-1]]), n-1))
+    return x[indx], y[indx]
+
+
+def reduce(x, y, domain=None, budget=PIXEL_BUDGET):
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if domain is not None:
+        x, y = crop(x, y, domain)
+    return minmax(x, y, budget)
@@ -0,0 +1,117 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+# -- Fast content digest for arrays and series.  The sample values,
+# -- dtype, shape and any time metadata (t0, dt) all go into the key
+def digest(data, *params):
+    arr = np.ascontiguousarray(getattr(data, 'value', data))
+    meta = [getattr(getattr(data, name, None), 'value', None)
+            for name in ('t0', 'dt')]
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr((arr.dtype.str, arr.shape, meta, params)).encode())
+    h.update(arr.data)
+    return h.hexdigest()
+
+
+def sizeof(value):
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    return len(value)
+
+
+# -- Every named ByteLRU, for reporting hit rates
+caches = {}
+
+
+def stats():
+    return {name: cache.stats() for name, cache in caches.items()}
+
+
+# -- Least-recently-used cache bounded by the total size of its values
+# -- rather than the number of entries.  Safe to share between the
+# -- script threads of concurrent Streamlit sessions.
+class ByteLRU:
+
+    def __init__(self, maxbytes, name=None):
+        self.name = name
+        if name is not None:
+            caches[name] = self
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, size = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = sizeof(value)
+        with self._lock:
+            if key in self._data:
+                self.nbytes -= self._data.pop(key)[1]
+            if size > self.maxbytes:
+                return value   #-- Too big to keep, just hand it back
+            self._data[key] = (value, size)
+            self.nbytes += size
+            while self.nbytes > self.maxbytes:
+                _, (_, oldsize) = self._data.popitem(last=False)
+                self.nbytes -= oldsize
+        return value
+
+    def items(self):
+        # -- (key, value) of every entry, least recently used first
+        with self._lock:
+            return [(key, value) for key, (value, size) in self._data.items()]
+
+    def get_or_compute(self, key, compute, stage=None):
+        # -- The value for key, calling compute() on a miss (timed as the
+        # -- metrics stage, if given) and keeping what it returns unless
+        # -- that is None.  Arrays are made read-only, as they are shared
+        import metrics   #-- Not at the top: metrics imports this module
+        value = self.get(key)
+        if value is not None:
+            return value
+        if stage is None:
+            value = compute()
+        else:
+            with metrics.stage(stage) as record:
+                value = compute()
+                record.nbytes = 0 if value is None else sizeof(value)
+        if value is None:
+            return None
+        if isinstance(value, np.ndarray):
+            value.flags.writeable = False
+        return self.put(key, value)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._data),
+            'nbytes': self.nbytes,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
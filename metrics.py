@@ -0,0 +1,236 @@
+# -- Lightweight tracing of the DSP, encoding and plotting stages: time
+# -- with @metrics.traced(name) or `with metrics.stage(name)`.  Totals are
+# -- served in Prometheus format on METRICS_HOST:METRICS_PORT/metrics when
+# -- METRICS_PORT is set; METRICS_LOG=1 also logs each stage as JSON
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import memo
+
+logger = logging.getLogger('metrics')
+LOG = os.environ.get('METRICS_LOG', '') not in ('', '0')
+HOST = os.environ.get('METRICS_HOST', '127.0.0.1')
+
+_lock = threading.Lock()
+_stages = {}      #-- name -> {'calls', 'seconds', 'max', 'bytes'}
+_counters = {}    #-- (name, label) -> count
+_local = threading.local()
+_server = None    #-- The /metrics server, or False if it could not start
+
+
+class Stage:
+
+    def __init__(self, name):
+        self.name = name
+        self.nbytes = None
+        self.seconds = None
+        self._start = time.perf_counter()
+
+    def stop(self):
+        if self.seconds is None:
+            self.seconds = time.perf_counter() - self._start
+            _record(self)
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def start(name):
+    return Stage(name)
+
+
+def stage(name):
+    return Stage(name)
+
+
+def traced(name):
+    # -- Time every call of a function, recording the size of its result
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name) as record:
+                result = func(*args, **kwargs)
+                if hasattr(result, 'nbytes') or isinstance(result, (bytes, bytearray)):
+                    record.nbytes = memo.sizeof(result)
+            return result
+        return wrapper
+    return decorator
+
+
+def _record(record):
+    with _lock:
+        totals = _stages.setdefault(record.name, {'calls': 0, 'seconds': 0.0,
+                                                  'max': 0.0, 'bytes': 0})
+        totals['calls'] += 1
+        totals['seconds'] += record.seconds
+        totals['max'] = max(totals['max'], record.seconds)
+        totals['bytes'] += record.nbytes or 0
+    events = getattr(_local, 'events', None)
+    if events is not None:
+        events.append(record)
+    if LOG:
+        logger.info(json.dumps({'stage': record.name, 'seconds': record.seconds,
+                                'bytes': record.nbytes,
+                                'thread': threading.current_thread().name}))
+
+
+def count(name, label='', n=1):
+    with _lock:
+        _counters[(name, label)] = _counters.get((name, label), 0) + n
+
+
+# -- Hit/miss counts for st.cache_data / st.cache_resource (or lru_cache)
+# -- functions.  Put cachestats above the caching decorator and call miss()
+# -- in the body, which only runs when the cache misses
+def cachestats(name):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            count('st_cache_calls', name)
+            return func(*args, **kwargs)
+        for attr in ('clear', 'cache_clear', 'cache_info'):
+            if hasattr(func, attr):
+                setattr(wrapper, attr, getattr(func, attr))
+        return wrapper
+    return decorator
+
+
+def miss(name):
+    count('st_cache_misses', name)
+
+
+def begin_run():
+    # -- Start collecting the stages of this script run
+    _local.events = []
+
+
+def run_events():
+    return list(getattr(_local, 'events', None) or [])
+
+
+def adopt(events):
+    # -- Add stages that ran on another thread (a worker) to this run
+    if getattr(_local, 'events', None) is not None:
+        _local.events.extend(events)
+
+
+def snapshot():
+    with _lock:
+        stages = {name: dict(totals) for name, totals in _stages.items()}
+        counters = dict(_counters)
+    return {'stages': stages, 'counters': counters, 'caches': memo.stats()}
+
+
+def prometheus():
+    snap = snapshot()
+    lines = []
+
+    def metric(name, kind, helptext, samples):
+        lines.append('# HELP {0} {1}'.format(name, helptext))
+        lines.append('# TYPE {0} {1}'.format(name, kind))
+        for labels, value in samples:
+            lines.append('{0}{{{1}}} {2}'.format(name, labels, value))
+
+    stages = sorted(snap['stages'].items())
+    metric('tutorial_stage_calls_total', 'counter', 'Calls of each traced stage.',
+           [('stage="{0}"'.format(n), t['calls']) for n, t in stages])
+    metric('tutorial_stage_seconds_total', 'counter', 'Time spent in each traced stage.',
+           [('stage="{0}"'.format(n), t['seconds']) for n, t in stages])
+    metric('tutorial_stage_seconds_max', 'gauge', 'Slowest single call of each stage.',
+           [('stage="{0}"'.format(n), t['max']) for n, t in stages])
+    metric('tutorial_stage_bytes_total', 'counter', 'Bytes produced by each stage.',
+           [('stage="{0}"'.format(n), t['bytes']) for n, t in stages])
+
+    counters = sorted(snap['counters'].items())
+    for name in sorted({name for (name, _), _ in counters}):
+        metric('tutorial_{0}_total'.format(name), 'counter', 'Count of {0}.'.format(name),
+               [('name="{0}"'.format(label), value)
+                for (n, label), value in counters if n == name])
+
+    caches = sorted(snap['caches'].items())
+    for field, kind in [('hits', 'counter'), ('misses', 'counter'),
+                        ('entries', 'gauge'), ('nbytes', 'gauge')]:
+        name = 'tutorial_cache_{0}'.format(field) + ('_total' if kind == 'counter' else '')
+        metric(name, kind, 'Shared cache {0}.'.format(field),
+               [('cache="{0}"'.format(c), s[field]) for c, s in caches])
+
+    # -- Figures left open leak memory in every process that draws them
+    pyplot = sys.modules.get('matplotlib.pyplot')
+    metric('tutorial_open_figures', 'gauge', 'Open matplotlib figures.',
+           [('', len(pyplot.get_fignums()) if pyplot else 0)])
+
+    # -- The load-adaptive quality tier (see quality.py), once the app runs
+    quality = sys.modules.get('quality')
+    if quality is not None:
+        status = quality.status()
+        metric('tutorial_quality_tier', 'gauge', 'Quality tier new reruns get (1 if active).',
+               [('tier="{0}"'.format(t), int(t == status['tier'])) for t in quality.TIERS])
+        metric('tutorial_quality_latency_seconds', 'gauge',
+               '90th percentile of recent rerun times.', [('', status['latency'] or 0)])
+        metric('tutorial_quality_queue_depth', 'gauge',
+               'DSP jobs queued or running per worker.', [('', status['depth'])])
+    return '\n'.join(lines) + '\n'
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = prometheus().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port=None):
+    # -- Start the /metrics endpoint once per process, if a port is given.
+    # -- If the port is taken (another app process on the host has it),
+    # -- log it once and carry on without the endpoint
+    global _server
+    port = port or os.environ.get('METRICS_PORT')
+    with _lock:
+        if _server is not None or not port:
+            return _server or None
+        try:
+            _server = ThreadingHTTPServer((HOST, int(port)), _Handler)
+        except OSError as exc:
+            logger.warning("Not serving /metrics on %s:%s: %s", HOST, port, exc)
+            _server = False
+            return None
+    threading.Thread(target=_server.serve_forever, daemon=True,
+                     name='metrics').start()
+    return _server
+
+
+def panel():
+    # -- Sidebar table of the stages in this session's current rerun
+    import streamlit as st
+
+    if not st.sidebar.checkbox("Show performance metrics", value=False):
+        return
+    rows = [{'stage': e.name, 'ms': round(1000*e.seconds, 1),
+             'bytes': e.nbytes} for e in run_events()]
+    st.sidebar.dataframe(rows, hide_index=True)
+    quality = sys.modules.get('quality')
+    if quality is not None:
+        st.sidebar.caption("Quality tier: {0}".format(quality.tier()))
+    st.sidebar.caption("Shared caches: " + ", ".join(
+        "{0} {1}/{2}".format(name, s['hits'], s['hits'] + s['misses'])
+        for name, s in memo.stats().items()))
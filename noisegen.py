@@ -0,0 +1,190 @@
+# -- Seeded colored noise of any length, generated one block at a time
+# -- (white noise shaped by a FIR filter, applied by overlap-add), so
+# -- memory does not grow with the duration:
+# --     python noisegen.py maze.wav [--duration 600] [--rate 32000] [--seed 1]
+import argparse
+from functools import lru_cache
+
+import numpy as np
+from scipy import fft, signal
+
+import precision
+
+BLOCKSIZE = 2**16
+
+# -- Length of the coloring filter in seconds, and the Kaiser window
+# -- that tapers it.  Half a second keeps a 1/f^2 shape within 1% of
+# -- the target from 35 Hz up
+FILTER_LENGTH = 0.5
+KAISER_BETA = 10
+
+
+@lru_cache(maxsize=None)
+def powerlaw(index=-2.0, fmin=30.0):
+    # -- Amplitude response f**index, zero below fmin.  Cached so equal
+    # -- arguments give the same function, and so the same filter design
+    def shape(freqs):
+        gain = np.zeros_like(freqs)
+        keep = freqs >= fmin
+        gain[keep] = freqs[keep]**index
+        return gain
+    return shape
+
+
+# -- The red noise of the tutorial: 1/f^2 with a 30 Hz cut-off
+REDNOISE = powerlaw(-2.0, 30.0)
+
+
+@lru_cache(maxsize=16)
+def design(shape, fs, filterlength=FILTER_LENGTH, beta=KAISER_BETA):
+    # -- Frequency-sampling design: the impulse response of shape(f),
+    # -- centred, cut to an odd number of taps and Kaiser windowed
+    ntaps = int(fs*filterlength) | 1
+    nfft = 2*(ntaps-1)
+    taps = fft.irfft(shape(fft.rfftfreq(nfft, 1.0/fs)), nfft)
+    taps = np.roll(taps, ntaps//2)[:ntaps] * signal.windows.kaiser(ntaps, beta)
+    taps.flags.writeable = False
+    return taps
+
+
+def white(nsamp, seed=None, scale=0.1, blocksize=BLOCKSIZE):
+    # -- nsamp normal samples in blocks, in the pipeline precision.  Draws
+    # -- run in sequence, so the samples match
+    # -- default_rng(seed).normal(scale=scale, size=nsamp)
+    rng = np.random.default_rng(seed)
+    for start in range(0, nsamp, blocksize):
+        yield precision.real(rng.normal(scale=scale, size=min(blocksize, nsamp-start)))
+
+
+def blocks(series, blocksize=BLOCKSIZE):
+    # -- An existing array or TimeSeries as a block stream
+    data = np.asarray(getattr(series, 'value', series))
+    for start in range(0, len(data), blocksize):
+        yield data[start:start+blocksize]
+
+
+def _overlapadd(stream, taps, flush):
+    # -- Linear convolution with taps, one block at a time.  Each block
+    # -- gives as many samples as it had; the last flush samples of the
+    # -- tail are given once the stream ends.  Sums run in double, and
+    # -- each block comes out in the stream's dtype
+    ntaps = len(taps)
+    spectra = {}
+    tail = np.zeros(ntaps-1)
+    dtype = None
+    for x in stream:
+        n = len(x)
+        if n == 0:
+            continue
+        dtype = x.dtype
+        nfft = fft.next_fast_len(n+ntaps-1, real=True)
+        if nfft not in spectra:
+            spectra[nfft] = fft.rfft(taps, nfft)
+        y = fft.irfft(fft.rfft(x, nfft) * spectra[nfft], nfft)[:n+ntaps-1]
+        y[:ntaps-1] += tail
+        tail = y[n:]
+        yield precision.real(y[:n], dtype)
+    if flush and dtype is not None:
+        yield precision.real(tail[:flush], dtype)
+
+
+def skip(stream, nsamp):
+    # -- Drop the first nsamp samples of a stream
+    for x in stream:
+        if nsamp >= len(x):
+            nsamp -= len(x)
+            continue
+        yield x[nsamp:]
+        nsamp = 0
+
+
+def take(stream, nsamp):
+    # -- Stop a stream after nsamp samples
+    for x in stream:
+        if nsamp <= 0:
+            return
+        yield x[:nsamp]
+        nsamp -= len(x)
+
+
+def color(stream, fs, shape=REDNOISE, filterlength=FILTER_LENGTH):
+    # -- Zero-phase coloring: output sample n lines up with input sample
+    # -- n, and the stream keeps its length.  Within half a filter length
+    # -- of either end the input is taken as zero
+    taps = design(shape, fs, filterlength)
+    delay = len(taps)//2
+    return skip(_overlapadd(stream, taps, delay), delay)
+
+
+def colored(fs, duration, shape=REDNOISE, seed=None, scale=0.1,
+            blocksize=BLOCKSIZE, filterlength=FILTER_LENGTH):
+    # -- duration seconds of noise with amplitude spectrum shape(f).  Extra
+    # -- white noise is drawn on both sides so every sample is fully colored
+    nsamp = int(fs*duration)
+    delay = len(design(shape, fs, filterlength))//2
+    stream = white(nsamp + 2*delay, seed, scale, blocksize)
+    return take(skip(color(stream, fs, shape, filterlength), delay), nsamp)
+
+
+def source(fs, duration, shape=REDNOISE, seed=None, **kwargs):
+    # -- A makeblocks() callable for audio.write_wav_blocks.  Every call
+    # -- replays the same noise, so an unseeded source draws a seed once
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+    return lambda: colored(fs, duration, shape, seed, **kwargs)
+
+
+def inject(stream, data, start=0):
+    # -- Add data into the stream starting at sample start
+    data = np.asarray(getattr(data, 'value', data))
+    pos = 0
+    for x in stream:
+        lo = max(start, pos)
+        hi = min(start+len(data), pos+len(x))
+        if lo < hi:
+            x = x.copy()
+            x[lo-pos:hi-pos] += data[lo-start:hi-start]
+        pos += len(x)
+        yield x
+
+
+def sosfilt(stream, sos):
+    # -- Causal IIR filtering with the state carried between blocks.
+    # -- Zero-phase (filtfilt) filtering needs the whole signal, so
+    # -- streamed output is delayed by the filter's group delay
+    zi = np.zeros((len(sos), 2))
+    for x in stream:
+        y, zi = signal.sosfilt(sos, x, zi=zi)
+        yield precision.match(y, x)
+
+
+def collect(stream, fs, t0=0):
+    # -- Gather a stream into a TimeSeries, for lengths that fit in memory
+    from gwpy.timeseries import TimeSeries
+    return TimeSeries(np.concatenate(list(stream)), sample_rate=fs, t0=t0)
+
+
+def maze(fs, duration, seed=None, volume=1e-8, secret='LOZ_Secret.wav', at=4):
+    # -- makeblocks() for the Red Noise section's maze, at any length
+    from gwpy.timeseries import TimeSeries
+    data = precision.real(TimeSeries.read(secret).value)
+    data -= data[0]
+    data *= volume/np.max(np.abs(data))
+    noise = source(fs, duration, seed=seed)
+    return lambda: inject(noise(), data, int(at*fs))
+
+
+if __name__ == '__main__':
+    import audio
+
+    parser = argparse.ArgumentParser(description="Seeded colored noise of any length")
+    parser.add_argument('output')
+    parser.add_argument('--duration', type=float, default=600)
+    parser.add_argument('--rate', type=int, default=32000)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--volume', type=float, default=1e-8)
+    args = parser.parse_args()
+
+    makeblocks = maze(args.rate, args.duration, args.seed, args.volume)
+    with open(args.output, 'wb') as f:
+        audio.write_wav_blocks(makeblocks, int(args.rate*args.duration), args.rate, f)
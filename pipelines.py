@@ -0,0 +1,123 @@
+# -- The heavy part of each filtering section, run on the worker pool
+# -- (see workers.py).  Each returns the images and audio the section
+# -- shows, and calls check() between stages so a superseded job stops early
+import filterbank
+import filtergrid
+import filters
+import plots
+import quality
+import spectra
+import tiles
+from audio import encode
+
+HIGHPASS_FFTLENGTH = 1   #-- Seconds, for the section 4 ASD at full quality
+
+
+def _audio(series):
+    # -- Same encoding as helper.play, at the job's quality tier
+    return encode(series, alpha=1.0/10, scale=0.9, maxrate=quality.setting('audio_rate'))
+
+
+def highpass(maze, fs, lowfreq, secret, cutoffs, check):
+    # -- Section 4: highpass the maze, plot its ASD, encode the audio.  With
+    # -- the secret (as injected), also chart its SNR against every cutoff
+    check('highpass')
+    highpassed = filters.highpass(maze, lowfreq)
+    check('asd')
+    # -- ASD of the highpassed data, derived from the cached ASD of maze.
+    # -- Only plotted (and scored), so its fftlength follows the quality tier
+    fftlength = HIGHPASS_FFTLENGTH * quality.setting('fftlength')
+    asdhp = filters.filtered_asd(spectra.asd(maze, fftlength), 'highpass', fs, lowfreq)
+    check('plot')
+    spectrum = plots.spectrum(asdhp, spans=[(1, lowfreq)],
+                              ylabel='Amplitude Spectral Density',
+                              ylim=[1e-12, 1e-5],
+                              xlim=[30, fs/2])
+    result = {'spectrum': spectrum}
+    if secret is not None:
+        check('filterbank')
+        snr = filterbank.highpass_snr(maze, secret, cutoffs, fftlength)
+        result['curve'] = plots.curve(cutoffs, snr, mark=lowfreq,
+                                      xlabel='High pass filter cutoff frequency (Hz)',
+                                      ylabel='Secret sound SNR (dB)')
+    check('audio')
+    result['audio'] = _audio(highpassed)
+    return result
+
+
+def whitening(maze, fs, whiten, check):
+    # -- Section 5: whiten with the TimeSeries.whiten defaults.  The ASD of
+    # -- the whitened data is derived from the plotted 1 s ASD and the ASD
+    # -- the whitening used, both cached, rather than by another Welch pass
+    check('asd')
+    asdmaze = spectra.asd(maze, 1)
+    if whiten:
+        check('whiten')
+        whitemaze = filters.whiten(maze)
+        asdwhite = spectra.whitened(asdmaze, filters.whitening_asd(maze), maze.dt.value)
+    else:
+        whitemaze = maze
+        asdwhite = asdmaze
+    check('plot')
+    timeseries = plots.timeseries(whitemaze)
+    spectrum = plots.spectrum(asdwhite, ylim=[1e-12, 1], xlim=[30, fs/2],
+                              ylabel='Amplitude Spectral Density')
+    check('audio')
+    return {'timeseries': timeseries, 'spectrum': spectrum, 'audio': _audio(whitemaze)}
+
+
+def bandpass(strains, t0, makewhite, low, high, check):
+    # -- Section 6, for every detector of an event at once: {detector:
+    # -- images and audio}.  The ASD plot of whitened data is derived from
+    # -- the 4 s ASD of the strain and the ASD the whitening used
+    check('asd')
+    asdwhite = {}
+    for detector, strain in strains.items():
+        asdstrain = spectra.asd(strain, 4)
+        if makewhite:
+            asdwhite[detector] = spectra.whitened(asdstrain, filters.whitening_asd(strain),
+                                                  strain.dt.value)
+        else:
+            asdwhite[detector] = asdstrain
+
+    # -- Only the plotted window and the audio clip are needed.  Look them
+    # -- up in the precomputed grid, and otherwise filter just the region
+    # -- around the clip, all detectors as one batch
+    check('bandpass')
+    windows = {detector: filtergrid.lookup(strain, detector, t0, makewhite, low, high)
+               for detector, strain in strains.items()}
+    todo = [detector for detector, found in windows.items() if found is None]
+    if todo:
+        if makewhite:
+            check('whiten')
+        data = [filtergrid.region(strains[d], t0, makewhite, low, high) for d in todo]
+        check('bandpass')
+        for detector, bp_data in zip(todo, filters.bandpass_many(data, low, high)):
+            windows[detector] = filtergrid.windows(bp_data, t0)
+
+    result = {}
+    for detector, strain in strains.items():
+        bp_plot, bp_audio = windows[detector]
+        check('plot')
+        timeseries = plots.timeseries(bp_plot, xlim=[t0-0.1, t0+0.1])
+        asdbp = filters.filtered_asd(asdwhite[detector], 'bandpass',
+                                     strain.sample_rate.value, low, high)
+        spectrum = plots.spectrum(asdbp, spans=[(1, low), (high, 1800)],
+                                  xlim=[10, 1800], ylabel='Amplitude Spectral Density')
+        check('audio')
+        result[detector] = {'timeseries': timeseries, 'spectrum': spectrum,
+                            'audio': _audio(bp_audio)}
+    return result
+
+
+def spectrogram(series, fftlength, tlim, flim, epoch, highpass, whiten, check):
+    # -- Section 7: highpass and/or whiten series (as sections 4 to 6 do),
+    # -- then draw the part in view from its cached spectrogram tiles
+    if highpass:
+        check('highpass')
+        series = filters.highpass(series, highpass)
+    if whiten:
+        check('whiten')
+        series = filters.whiten(series)
+    check('spectrogram')
+    return tiles.render(series, fftlength, tlim, flim, epoch=epoch)
@@ -0,0 +1,110 @@
+import io
+
+# -- Use Agg backend to be thread safe
+import matplotlib as mpl
+mpl.use("agg")
+import matplotlib.pyplot as plt
+import numpy as np
+
+import bundle
+import metrics
+import quality
+import spectra
+from memo import ByteLRU, digest
+
+# -- Rendered figures are kept as PNG bytes, shared by all sessions.
+# -- Figures are always closed once rasterized, so nothing leaks between
+# -- page views
+PLOT_CACHE_BYTES = 64 * 2**20
+DPI = 200   #-- Same as st.pyplot
+cache = ByteLRU(PLOT_CACHE_BYTES, name='plots')
+
+
+def rasterize(fig, dpi=DPI):
+    try:
+        with metrics.stage('rasterize') as record:
+            image = io.BytesIO()
+            fig.savefig(image, bbox_inches='tight', dpi=dpi, format='png')
+            record.nbytes = image.tell()
+        return image.getvalue()
+    finally:
+        plt.close(fig)
+
+
+def _lookup(key):
+    # -- Rendered before, or prebuilt in the bundle; None otherwise
+    return cache.get_or_compute(key, lambda: bundle.payload('plots', key))
+
+
+def render(key, draw, dpi=DPI):
+    # -- draw() is only called when key has not been rendered before.
+    # -- Under load (see quality.py) the DPI is lowered, and a render from
+    # -- a better tier is used instead if there is one already.  key is a
+    # -- tuple, or a function of the tier for figures that change with it
+    keyfor = key if callable(key) else (lambda tier: key)
+    tier = quality.tier()
+    tiers = [tier] + list(quality.TIERS[:quality.TIERS.index(tier)])
+    for candidate in tiers:
+        image = _lookup(keyfor(candidate) + (round(dpi * quality.SETTINGS[candidate]['dpi']),))
+        if image is not None:
+            return image
+    dpi = round(dpi * quality.SETTINGS[tier]['dpi'])
+    with metrics.stage('plot'):
+        fig = draw()
+    return cache.put(keyfor(tier) + (dpi,), rasterize(fig, dpi))
+
+
+def _options(kwargs):
+    return repr(sorted(kwargs.items()))
+
+
+def timeseries(series, dpi=DPI, **kwargs):
+    return render(('timeseries', digest(series), _options(kwargs)),
+                  lambda: series.plot(**kwargs), dpi)
+
+
+def _spectrum(asd, spans, kwargs):
+    fig = asd.plot(**kwargs)
+    ax = fig.gca()
+    for low, high in spans:
+        ax.axvspan(low, high, color='red', alpha=0.3, label='Removed by filter')
+    return fig
+
+
+def spectrum(asd, spans=(), dpi=DPI, **kwargs):
+    # -- spans are (low, high) bands shaded as removed by a filter
+    spans = tuple(tuple(span) for span in spans)
+    return render(('spectrum', digest(asd), spans, _options(kwargs)),
+                  lambda: _spectrum(asd, spans, kwargs), dpi)
+
+
+def curve(x, y, mark=None, dpi=DPI, xlabel=None, ylabel=None):
+    # -- A line of y against x, with a vertical line at x=mark
+    x = tuple(float(v) for v in x)
+
+    def draw():
+        fig, ax = plt.subplots(figsize=(12, 4))
+        ax.plot(x, y, marker='o')
+        if mark is not None:
+            ax.axvline(mark, color='red', alpha=0.5)
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel(ylabel)
+        ax.grid(True, alpha=0.3)
+        return fig
+
+    return render(('curve', x, digest(np.asarray(y)), mark, xlabel, ylabel), draw, dpi)
+
+
+def asd(series, fftlength, spans=(), dpi=DPI, **kwargs):
+    # -- Only plotted, so the fftlength follows the quality tier.  Keyed by
+    # -- the series, so a better tier's render is found without estimating
+    # -- its ASD
+    spans = tuple(tuple(span) for span in spans)
+    key = ('asd', digest(series), spans, _options(kwargs))
+
+    def draw():
+        length = fftlength * quality.setting('fftlength')
+        return _spectrum(spectra.asd(series, length), spans, kwargs)
+
+    return render(lambda tier: key + (fftlength * quality.SETTINGS[tier]['fftlength'],),
+                  draw, dpi)
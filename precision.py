@@ -0,0 +1,33 @@
+# -- Floating point precision of the signal pipeline.  PRECISION=float32
+# -- keeps sources, filtered outputs and spectra in float32 (complex64)
+# -- throughout, halving their memory; the default is float64.  Check the
+# -- audio stays within tolerance with `python precisioncheck.py`
+import os
+
+import numpy as np
+
+PRECISION = os.environ.get('PRECISION', 'float64')
+DTYPE = np.dtype(PRECISION)
+if DTYPE not in (np.float32, np.float64):
+    raise ValueError("PRECISION must be float32 or float64, not '{0}'".format(PRECISION))
+
+
+def real(data, dtype=None):
+    # -- data in the pipeline precision (or dtype), without a copy if it
+    # -- already is.  Works for arrays and gwpy series alike
+    dtype = DTYPE if dtype is None else np.dtype(dtype)
+    if data.dtype == dtype:
+        return data
+    return data.astype(dtype)
+
+
+def match(result, source):
+    # -- Cast result back to the precision of source: scipy's IIR filters
+    # -- and gwpy's whitening compute in double whatever they are given.
+    # -- Keeps complex results complex
+    dtype = np.dtype(source.dtype)
+    if np.iscomplexobj(result):
+        dtype = np.result_type(dtype, np.complex64)
+    if result.dtype == dtype:
+        return result
+    return result.astype(dtype)
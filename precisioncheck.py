@@ -0,0 +1,107 @@
+"""Audible difference check for the float32 precision mode.
+
+Builds the audio of every section in a fresh interpreter for each of
+PRECISION=float64 and PRECISION=float32 (GWOSC replaced by the offline
+stand-in in gwoscfixture.py), then compares the 16 bit samples::
+
+    python precisioncheck.py [tolerance in LSB]
+
+Prints the largest sample difference and the signal to error ratio of
+each clip, and the bytes held by each mode.  Fails if any clip differs
+by more than the tolerance (TOLERANCE by default), or if a float32 stage
+produced float64 or complex128 data.
+"""
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+# -- Largest allowed difference in 16 bit samples.  Storing the maze in
+# -- float32 costs about a part in 10^7 of its low frequency peak, which
+# -- whitening brings up to about ten samples (about 70 dB below the
+# -- signal): the 2 s whitening ASD resolves the empty band below 30 Hz
+TOLERANCE = 12
+
+_PROBE = '''
+import io, json, logging, sys, warnings
+warnings.simplefilter('ignore')
+logging.disable(logging.WARNING)
+import numpy as np
+from scipy.io import wavfile
+
+import events, filtergrid, filters, gwoscfixture, precision, spectra
+from audio import encode_wav
+from helper import makescenario
+
+clips, dtypes, nbytes = {}, {}, 0
+
+
+def keep(name, data, audio=True):
+    global nbytes
+    dtypes[name] = str(data.dtype)
+    nbytes += data.nbytes
+    if audio:
+        clips[name] = wavfile.read(io.BytesIO(encode_wav(data)))[1]
+
+
+fs = 32000
+scenario = makescenario(fs, 8, seed=1)
+keep('noise', scenario['noise'])
+keep('colorednoise', scenario['colorednoise'], audio=False)
+keep('secret', scenario['secret'])
+for volume, maze in scenario['maze'].items():
+    keep('maze ' + volume, maze)
+    keep('asd ' + volume, spectra.asd(maze, 1), audio=False)
+    for cutoff in (1, 100, 500, 1000, 3000):
+        keep('highpass {0} {1}'.format(volume, cutoff), filters.highpass(maze, cutoff))
+    keep('whiten ' + volume, filters.whiten(maze))
+
+with gwoscfixture.offline():
+    strain = events.segment('H1', filtergrid.strainstore.GW150914)
+    keep('strain', strain, audio=False)
+    for white in (False, True):
+        for low, high in ((1, 1200), (30, 400)):
+            _, clip = filtergrid.process(strain, filtergrid.strainstore.GW150914,
+                                         white, low, high)
+            keep('strain {0} {1}-{2}'.format('white' if white else 'raw', low, high), clip)
+
+np.savez(sys.argv[1], **clips)
+print(json.dumps({'dtypes': dtypes, 'nbytes': nbytes}))
+'''
+
+
+def run(mode, output):
+    here = os.path.dirname(os.path.abspath(__file__))
+    out = subprocess.run([sys.executable, '-c', _PROBE, output],
+                         capture_output=True, text=True, check=True, cwd=here,
+                         env=dict(os.environ, PRECISION=mode))
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    tolerance = int(sys.argv[1]) if len(sys.argv) > 1 else TOLERANCE
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        double = run('float64', os.path.join(tmp, 'float64.npz'))
+        single = run('float32', os.path.join(tmp, 'float32.npz'))
+        ref = np.load(os.path.join(tmp, 'float64.npz'))
+        new = np.load(os.path.join(tmp, 'float32.npz'))
+        worst = 0
+        for name in ref.files:
+            err = ref[name].astype(float) - new[name].astype(float)
+            diff = int(np.max(np.abs(err)))
+            snr = 10*np.log10(np.mean(ref[name].astype(float)**2) / max(np.mean(err**2), 1e-12))
+            worst = max(worst, diff)
+            print("{0:28s} {1:3d} LSB {2:6.1f} dB".format(name, diff, snr))
+
+    upcast = {name: dtype for name, dtype in single['dtypes'].items()
+              if dtype not in ('float32', 'complex64')}
+    print("Held: {0:.1f} MB float64, {1:.1f} MB float32".format(
+        double['nbytes'] / 2**20, single['nbytes'] / 2**20))
+    print("Largest difference: {0} LSB (tolerance {1})".format(worst, tolerance))
+    if upcast:
+        print("Not float32: {0}".format(upcast))
+    if upcast or worst > tolerance:
+        sys.exit(1)
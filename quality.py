@@ -0,0 +1,122 @@
+# -- Load-adaptive quality tiers: step down to a cheaper tier when recent
+# -- reruns are slow or the DSP queue is deep, and back up when they
+# -- recover.  A rerun (and its worker jobs) keeps the tier it started
+# -- with.  QUALITY=full/reduced/minimal pins a tier; the default, auto,
+# -- adapts with the QUALITY_SLOW/FAST/QUEUE/HOLD thresholds below
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+import metrics
+
+# -- Tiers, best first.  full: everything as designed; reduced: audio
+# -- decimated to 16 kHz, display ASDs with half the fftlength, plots at
+# -- half the DPI, half the points in browser charts; minimal: audio at
+# -- 8 kHz, a quarter of the fftlength and points, plots at 3/8 of the DPI.  A degraded tier reuses a better tier's cached
+# -- render when there is one (see plots.render)
+TIERS = ('full', 'reduced', 'minimal')
+SETTINGS = {
+    'full':    {'audio_rate': None, 'fftlength': 1.0, 'dpi': 1.0, 'points': 1.0},
+    'reduced': {'audio_rate': 16000, 'fftlength': 0.5, 'dpi': 0.5, 'points': 0.5},
+    'minimal': {'audio_rate': 8000, 'fftlength': 0.25, 'dpi': 0.375, 'points': 0.25},
+}
+
+# -- Step down when the 90th percentile rerun time (s) is above SLOW or
+# -- there are more than QUEUE DSP jobs per worker, up when it is below
+# -- FAST, and no more often than every HOLD seconds
+MODE = os.environ.get('QUALITY', 'auto')
+SLOW = float(os.environ.get('QUALITY_SLOW', 2.0))
+FAST = float(os.environ.get('QUALITY_FAST', 0.5))
+QUEUE = float(os.environ.get('QUALITY_QUEUE', 2.0))
+HOLD = float(os.environ.get('QUALITY_HOLD', 10.0))
+WINDOW = 30      #-- Seconds of reruns the latency is taken over
+MIN_RUNS = 3     #-- Reruns needed before latency counts
+
+_lock = threading.Lock()
+_local = threading.local()
+_level = 0                     #-- Index into TIERS
+_switched = time.monotonic()   #-- When _level last changed
+_latencies = deque()           #-- (time, seconds) of recent reruns at this level
+
+
+def _depth():
+    # -- DSP jobs queued or running per worker.  The pool is only imported
+    # -- by the sections that use it, so no pool means no queue
+    workers = sys.modules.get('workers')
+    if workers is None:
+        return 0.0
+    return workers.depth('dsp') / max(1, workers.DSP_WORKERS)
+
+
+def _latency(now):
+    # -- 90th percentile of the reruns in the last WINDOW seconds
+    while _latencies and _latencies[0][0] < now - WINDOW:
+        _latencies.popleft()
+    if len(_latencies) < MIN_RUNS:
+        return None
+    ordered = sorted(seconds for _, seconds in _latencies)
+    return ordered[int(0.9 * (len(ordered) - 1))]
+
+
+def _step(now):
+    # -- With _lock held: move one tier down if overloaded, one up if idle
+    global _level, _switched
+    if now - _switched < HOLD:
+        return
+    latency, depth = _latency(now), _depth()
+    if (latency is not None and latency > SLOW) or depth > QUEUE:
+        level = min(_level + 1, len(TIERS) - 1)
+    elif (latency is None or latency < FAST) and depth <= 1:
+        level = max(_level - 1, 0)
+    else:
+        return
+    if level != _level:
+        _level, _switched = level, now
+        _latencies.clear()   #-- Judge the new tier on its own reruns
+        metrics.count('quality_switches', TIERS[level])
+
+
+def current():
+    # -- The tier new reruns get
+    if MODE in SETTINGS:
+        return MODE
+    with _lock:
+        _step(time.monotonic())
+        return TIERS[_level]
+
+
+def begin_run():
+    # -- Pick the tier for this script run, which it keeps to the end
+    tier = pin(current())
+    metrics.count('quality_runs', tier)
+    return tier
+
+
+def pin(tier):
+    # -- Use tier for the rest of this thread's run (a worker job runs
+    # -- with the tier of the rerun that asked for it)
+    _local.tier = tier
+    return tier
+
+
+def tier():
+    return getattr(_local, 'tier', None) or current()
+
+
+def setting(name):
+    return SETTINGS[tier()][name]
+
+
+def observe(seconds):
+    # -- Record how long a rerun took
+    with _lock:
+        _latencies.append((time.monotonic(), seconds))
+
+
+def status():
+    with _lock:
+        now = time.monotonic()
+        return {'tier': MODE if MODE in SETTINGS else TIERS[_level],
+                'latency': _latency(now), 'depth': _depth()}
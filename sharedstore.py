@@ -0,0 +1,166 @@
+# -- Arrays shared read-only between the Streamlit processes on a host:
+# -- the first process to need a set writes it as .npy files under
+# -- SHARED_STORE (/dev/shm if there is one), and every process memory
+# -- maps them.  The last process to exit empties the store.  Where
+# -- there is no store (no fcntl, or nowhere to write), each process
+# -- builds its own arrays
+import atexit
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+from gwpy.timeseries import TimeSeries
+
+import metrics
+
+
+def _default():
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    user = os.getuid() if hasattr(os, 'getuid') else os.environ.get('USERNAME', 'user')
+    return os.path.join(base, 'signal-tutorial-{0}'.format(user))
+
+
+SHARED_STORE = os.environ.get('SHARED_STORE', _default())
+
+_lock = threading.Lock()
+_registered = None    #-- Store this process registered with, if any
+
+
+@contextlib.contextmanager
+def _flock(name, store=None):
+    # -- Exclusive lock across processes (and, with _lock, across threads).
+    # -- fcntl is POSIX only: raises ImportError elsewhere
+    import fcntl
+    with _lock, open(os.path.join(store or SHARED_STORE, name), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _register():
+    # -- Under the store lock, so the last process leaving cannot remove
+    # -- the store between this check and the first read
+    global _registered
+    if _registered == SHARED_STORE:
+        return
+    os.makedirs(SHARED_STORE, exist_ok=True)
+    with _flock('lock'):
+        os.makedirs(os.path.join(SHARED_STORE, 'procs'), exist_ok=True)
+        with open(os.path.join(SHARED_STORE, 'procs', str(os.getpid())), 'w'):
+            pass
+    if _registered is None:
+        atexit.register(release)
+    _registered = SHARED_STORE
+
+
+def release():
+    # -- Unregister this process, and empty the store if it was the last
+    # -- one using it.  Processes that died without unregistering are
+    # -- skipped
+    global _registered
+    store = _registered
+    if store is None:
+        return
+    _registered = None
+    procs = os.path.join(store, 'procs')
+    with _flock('lock', store):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(procs, str(os.getpid())))
+        try:
+            others = [name for name in os.listdir(procs) if _alive(int(name))]
+        except FileNotFoundError:
+            others = []
+        if not others:
+            # -- Everything but the lock file, which is still held: removing
+            # -- it would let the next process lock a new file of that name
+            for name in os.listdir(store):
+                path = os.path.join(store, name)
+                if name == 'lock':
+                    continue
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(path)
+
+
+def key(*params):
+    return hashlib.blake2b(repr(params).encode(), digest_size=16).hexdigest()
+
+
+def _write(path, series):
+    # -- Into a scratch directory first, renamed into place when complete
+    tmp = '{0}.tmp-{1}'.format(path, os.getpid())
+    try:
+        os.makedirs(tmp)
+        meta = {}
+        for name, value in series.items():
+            np.save(os.path.join(tmp, name + '.npy'), np.asarray(value.value))
+            meta[name] = {'t0': value.t0.value, 'sample_rate': value.sample_rate.value,
+                          'unit': str(value.unit), 'name': value.name}
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        os.rename(tmp, path)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+
+def _read(path):
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    return {name: TimeSeries(np.load(os.path.join(path, name + '.npy'), mmap_mode='r'),
+                             t0=m['t0'], sample_rate=m['sample_rate'], unit=m['unit'],
+                             name=m['name'], copy=False)
+            for name, m in meta.items()}
+
+
+def _frozen(series):
+    # -- Read-only, as the mapped arrays are
+    for value in series.values():
+        value.flags.writeable = False
+    return series
+
+
+def load(params, compute):
+    # -- {name: read-only TimeSeries} for params, memory mapped from the
+    # -- store.  compute() returns the same dict and only runs in the
+    # -- first process to ask for params.  Without a usable store, every
+    # -- process runs compute() and keeps its own arrays
+    try:
+        _register()
+    except (ImportError, OSError):
+        metrics.count('shared_store', 'fallback')
+        return _frozen(compute())
+    path = os.path.join(SHARED_STORE, key(*params))
+    if not os.path.exists(path):
+        with _flock('lock-' + os.path.basename(path)):
+            if not os.path.exists(path):
+                metrics.count('shared_store', 'fill')
+                with metrics.stage('shared_fill'):
+                    series = compute()
+                try:
+                    _write(path, series)
+                except OSError:
+                    metrics.count('shared_store', 'fallback')
+                    return _frozen(series)
+                return _read(path)
+    metrics.count('shared_store', 'attach')
+    return _read(path)
@@ -0,0 +1,52 @@
+import numpy as np
+from scipy import signal
+
+import precision
+from memo import ByteLRU, digest
+
+# -- Welch spectra shared by the plots and the whitening step.  Each
+# -- (data, fftlength, overlap, window, method) is estimated once, and the
+# -- ASDs of filtered or whitened data are derived from it in the frequency
+# -- domain instead of running a new Welch pass
+SPECTRA_CACHE_BYTES = 64 * 2**20
+cache = ByteLRU(SPECTRA_CACHE_BYTES, name='spectra')
+
+
+def default_fftlength(series):
+    # -- Same choice TimeSeries.whiten makes when fftlength is None
+    return int(max(2, np.ceil(2048 * series.dt.decompose().value)))
+
+
+def asd(series, fftlength, overlap=None, window='hann', method='median'):
+    # -- Estimated in double: a float32 PSD of strain (~1e-46 /Hz) would
+    # -- underflow.  The ASD itself is kept in the input's precision
+    return cache.get_or_compute(
+        ('asd', digest(series), fftlength, overlap, window, method),
+        lambda: precision.match(
+            precision.real(series, 'float64').asd(
+                fftlength, overlap=overlap, window=window, method=method),
+            series),
+        'asd')
+
+
+def filtered(spectrum, sos, fs):
+    # -- ASD after a zero-phase (forward-backward) SOS filter, which
+    # -- scales each frequency by |H(f)|^2
+    def compute():
+        _, h = signal.sosfreqz(sos, worN=spectrum.frequencies.value, fs=fs)
+        return precision.match(spectrum * np.abs(h)**2, spectrum)
+
+    return cache.get_or_compute(('filtered', digest(spectrum), digest(sos), fs),
+                                compute, 'filtered')
+
+
+def whitened(spectrum, whitening, dt):
+    # -- ASD after TimeSeries.whiten(asd=whitening), which filters by
+    # -- 1/whitening and rescales by sqrt(2 dt)
+    def compute():
+        gain = np.interp(spectrum.frequencies.value,
+                         whitening.frequencies.value, whitening.value)
+        return precision.match(spectrum / gain * np.sqrt(2 * dt), spectrum)
+
+    return cache.get_or_compute(('whitened', digest(spectrum), digest(whitening), dt),
+                                compute, 'whitened')
@@ -0,0 +1,97 @@
+# -- Local store of GWOSC strain segments, kept as .npy arrays with a JSON
+# -- sidecar and memory mapped when read.  `python strainstore.py` fills it
+# -- before deploying, so the section works offline for those segments
+import json
+import os
+
+import numpy as np
+from gwpy.timeseries import TimeSeries
+
+import metrics
+import precision
+
+STRAIN_STORE = os.environ.get(
+    'STRAIN_STORE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'strain'))
+SAMPLE_RATE = 4096
+
+# -- Segments used by the app: (detector, gps start, gps end)
+GW150914 = 1126259462.4
+SEGMENTS = [
+    ('H1', GW150914-14, GW150914+14),
+    ('L1', GW150914-14, GW150914+14),
+]
+
+
+def path(detector, start, end, rate=SAMPLE_RATE):
+    name = '{0}-{1!r}-{2!r}-{3}'.format(detector, float(start), float(end), int(rate))
+    return os.path.join(STRAIN_STORE, name)
+
+
+def exists(detector, start, end, rate=SAMPLE_RATE):
+    base = path(detector, start, end, rate)
+    return os.path.exists(base + '.npy') and os.path.exists(base + '.json')
+
+
+@metrics.traced('strain_read')
+def read(detector, start, end, rate=SAMPLE_RATE):
+    # -- Read-only, memory mapped: no copy of the samples is made, unless
+    # -- the store was written in another precision
+    base = path(detector, start, end, rate)
+    with open(base + '.json') as f:
+        meta = json.load(f)
+    data = np.load(base + '.npy', mmap_mode='r')
+    return precision.real(TimeSeries(data, t0=meta['t0'], sample_rate=meta['sample_rate'],
+                                     unit=meta['unit'], name=meta['name'], copy=False))
+
+
+def write(strain, detector, start, end, rate=SAMPLE_RATE):
+    # -- Write to temporary files first, so a reader never sees half a file
+    os.makedirs(STRAIN_STORE, exist_ok=True)
+    base = path(detector, start, end, rate)
+    meta = {
+        't0': strain.t0.value,
+        'sample_rate': strain.sample_rate.value,
+        'unit': str(strain.unit),
+        'name': strain.name,
+    }
+    with open(base + '.tmp.npy', 'wb') as f:
+        np.save(f, precision.real(np.asarray(strain.value)))
+    with open(base + '.tmp.json', 'w') as f:
+        json.dump(meta, f)
+    os.replace(base + '.tmp.npy', base + '.npy')
+    os.replace(base + '.tmp.json', base + '.json')
+
+
+@metrics.traced('gwosc_fetch')
+def fetch(detector, start, end, rate=SAMPLE_RATE):
+    strain = TimeSeries.fetch_open_data(detector, start, end,
+                                        sample_rate=rate, cache=False)
+    try:
+        write(strain, detector, start, end, rate)
+    except OSError:
+        # -- Nowhere to keep it: use the copy already in memory
+        metrics.count('strain_store', 'unwritable')
+        return precision.real(strain)
+    return read(detector, start, end, rate)
+
+
+def load(detector, start, end, rate=SAMPLE_RATE):
+    # -- From the store when present, otherwise from GWOSC (and keep it)
+    if exists(detector, start, end, rate):
+        return read(detector, start, end, rate)
+    return fetch(detector, start, end, rate)
+
+
+def warm(segments=SEGMENTS, rate=SAMPLE_RATE):
+    for detector, start, end in segments:
+        if exists(detector, start, end, rate):
+            print("Have {0}".format(os.path.basename(path(detector, start, end, rate))))
+            continue
+        fetch(detector, start, end, rate)
+        if not exists(detector, start, end, rate):
+            raise OSError("Cannot write to {0}".format(STRAIN_STORE))
+        print("Fetched {0}".format(os.path.basename(path(detector, start, end, rate))))
+
+
+if __name__ == '__main__':
+    warm()
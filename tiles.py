@@ -0,0 +1,116 @@
+# -- Tiled, multi-resolution spectrograms.  Level 0 tiles hold
+# -- TILE_COLUMNS columns one hop apart, each level above halves the
+# -- columns.  Tiles are computed when a view first touches them and
+# -- cached, and views are drawn with imshow and cached as PNG images
+import numpy as np
+from scipy import fft, signal
+
+import plots
+from plots import plt
+from memo import ByteLRU, digest
+
+TILE_COLUMNS = 256
+MAX_COLUMNS = 1024    #-- Columns drawn for one view, at most
+LEVELS = 8
+
+TILE_CACHE_BYTES = 128 * 2**20
+cache = ByteLRU(TILE_CACHE_BYTES, name='tiles')
+
+
+def _hop(nperseg, level):
+    # -- Level 0 frames overlap by 3/4
+    return (nperseg // 4) << level
+
+
+def _tile(series, key, nperseg, level, index):
+    # -- Power in dB of columns [index*TILE_COLUMNS, (index+1)*TILE_COLUMNS)
+    # -- at level; column j is a Hann-windowed frame centred on sample j*hop
+    def compute():
+        hop = _hop(nperseg, level)
+        data = np.asarray(series.value, dtype=np.float64)
+        first = index * TILE_COLUMNS
+        ncols = min(TILE_COLUMNS, (len(data) - 1) // hop + 1 - first)
+        start = first*hop - nperseg//2
+        stop = (first + ncols - 1)*hop + nperseg - nperseg//2
+        chunk = np.zeros(stop - start)
+        lo, hi = max(start, 0), min(stop, len(data))
+        chunk[lo-start:hi-start] = data[lo:hi]
+        frames = np.lib.stride_tricks.sliding_window_view(chunk, nperseg)[::hop]
+        window = signal.windows.hann(nperseg, sym=False)
+        rate = series.sample_rate.value
+        power = np.abs(fft.rfft(frames * window, axis=-1))**2 / (rate * np.sum(window**2))
+        power[:, 1:-1] *= 2      #-- One-sided density
+        return (10*np.log10(power.T + 1e-300)).astype(np.float32)
+
+    return cache.get_or_compute(key + (nperseg, level, index), compute, 'spectrogram_tile')
+
+
+def level(duration, rate, nperseg, columns=MAX_COLUMNS):
+    # -- Finest level that draws duration seconds in at most columns
+    for lvl in range(LEVELS):
+        if duration * rate / _hop(nperseg, lvl) <= columns:
+            return lvl
+    return LEVELS - 1
+
+
+def view(series, fftlength, tlim, flim, columns=MAX_COLUMNS):
+    # -- (times, frequencies, dB) covering tlim (seconds, absolute) and
+    # -- flim (Hz), built from the tiles in view only
+    rate = series.sample_rate.value
+    t0 = series.t0.value
+    nperseg = int(round(fftlength * rate))
+    lvl = level(tlim[1] - tlim[0], rate, nperseg, columns)
+    hop = _hop(nperseg, lvl)
+    ncols = (len(series) - 1) // hop + 1
+    first = max(int(np.floor((tlim[0] - t0) * rate / hop)), 0)
+    last = min(int(np.ceil((tlim[1] - t0) * rate / hop)), ncols - 1)
+
+    key = (digest(series),)
+    tiles = [_tile(series, key, nperseg, lvl, index)
+             for index in range(first // TILE_COLUMNS, last // TILE_COLUMNS + 1)]
+    offset = (first // TILE_COLUMNS) * TILE_COLUMNS
+    power = np.concatenate(tiles, axis=1)[:, first-offset:last-offset+1]
+
+    freqs = fft.rfftfreq(nperseg, 1.0/rate)
+    rows = (freqs >= flim[0]) & (freqs <= flim[1])
+    times = t0 + np.arange(first, last+1) * hop / rate
+    return times, freqs[rows], power[rows]
+
+
+def _widen(lim, width, bounds):
+    # -- lim clipped to bounds and widened about its centre to at least
+    # -- width, so a view always holds at least one bin
+    lo, hi = max(float(lim[0]), bounds[0]), min(float(lim[1]), bounds[1])
+    if hi - lo < width:
+        centre = min(max((lo + hi) / 2, bounds[0] + width/2), bounds[1] - width/2)
+        lo, hi = centre - width/2, centre + width/2
+    return lo, hi
+
+
+def render(series, fftlength, tlim, flim, columns=MAX_COLUMNS, dpi=plots.DPI,
+           epoch=0):
+    # -- PNG of a view, rasterized with imshow.  Times are drawn relative
+    # -- to epoch
+    rate = series.sample_rate.value
+    tlim = _widen(tlim, fftlength, tuple(series.span))
+    flim = _widen(flim, 1/fftlength, (0, rate/2))
+
+    def draw():
+        times, freqs, power = view(series, fftlength, tlim, flim, columns)
+        fig, ax = plt.subplots(figsize=(12, 4))
+        dt = times[1] - times[0] if len(times) > 1 else fftlength
+        df = freqs[1] - freqs[0] if len(freqs) > 1 else 1.0
+        vmin, vmax = np.percentile(power, [5, 99.9]) if power.size else (0, 1)
+        image = ax.imshow(power, origin='lower', aspect='auto', cmap='viridis',
+                          interpolation='nearest', vmin=vmin, vmax=vmax,
+                          extent=[times[0]-epoch-dt/2, times[-1]-epoch+dt/2,
+                                  freqs[0]-df/2, freqs[-1]+df/2])
+        ax.set_xlim(tlim[0]-epoch, tlim[1]-epoch)
+        ax.set_ylim(*flim)
+        ax.set_xlabel('Time (s)')
+        ax.set_ylabel('Frequency (Hz)')
+        fig.colorbar(image, ax=ax, label='Power (dB)')
+        return fig
+
+    return plots.render(('spectrogram', digest(series), fftlength, tlim, flim, columns,
+                         epoch), draw, dpi)
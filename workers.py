@@ -0,0 +1,153 @@
+# -- Bounded worker pool for the heavy parts of the filtering sections.
+# -- Jobs are keyed by their parameters: one in flight is shared by every
+# -- session asking for it, and one nobody waits for any more is dropped.
+# -- DSP_WORKERS sets the pool size (0 runs inline); downloads use IO_WORKERS
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import metrics
+import quality
+
+DSP_WORKERS = int(os.environ.get('DSP_WORKERS', min(4, os.cpu_count() or 1)))
+IO_WORKERS = int(os.environ.get('IO_WORKERS', 8))
+
+# -- How often a waiting script thread updates its status, which is also
+# -- when Streamlit can stop it for a rerun
+POLL_INTERVAL = 0.2
+
+_lock = threading.RLock()   #-- Cancelling a future runs _finished in this thread
+_pools = {}       #-- name -> ThreadPoolExecutor
+_inflight = {}    #-- key -> Job
+_latest = {}      #-- (session, slot) -> Job
+
+
+class Superseded(Exception):
+    pass
+
+
+class Job:
+
+    def __init__(self, key, pool, tier):
+        self.key = key
+        self.pool = pool
+        self.tier = tier
+        self.stage = 'queued'
+        self.waiters = set()
+        self.events = []
+        self.future = None
+        self._cancelled = threading.Event()
+
+    def check(self, stage):
+        # -- Called by the job between stages: stop here if nobody wants
+        # -- the result any more
+        if self._cancelled.is_set():
+            raise Superseded(self.key)
+        self.stage = stage
+
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def _run(self, func, args):
+        metrics.begin_run()
+        quality.pin(self.tier)
+        try:
+            return func(*args, check=self.check)
+        finally:
+            self.events = metrics.run_events()
+
+    def _release(self, owner):
+        # -- With _lock held
+        self.waiters.discard(owner)
+        if self.waiters or self.future.done():
+            return
+        self._cancelled.set()
+        metrics.count(self.pool + '_jobs', 'cancelled' if self.future.cancel() else 'superseded')
+        if _inflight.get(self.key) is self:
+            del _inflight[self.key]
+
+
+def _executor(pool):
+    if pool not in _pools:
+        size = {'dsp': DSP_WORKERS, 'io': IO_WORKERS}[pool]
+        _pools[pool] = ThreadPoolExecutor(max(1, size), thread_name_prefix=pool)
+    return _pools[pool]
+
+
+def _finished(job):
+    with _lock:
+        if _inflight.get(job.key) is job:
+            del _inflight[job.key]
+        for owner in [o for o, j in _latest.items() if j is job]:
+            del _latest[owner]
+
+
+def submit(key, func, *args, owner=None, pool='dsp', tier=None):
+    # -- The job for key, shared with any other caller already waiting on
+    # -- it.  func(*args, check=job.check) runs on the pool, at the quality
+    # -- tier of the caller (or tier).  owner is a (session, slot) pair
+    # -- whose previous job is dropped if unwanted
+    tier = tier or quality.tier()
+    with _lock:
+        job = _inflight.get(key)
+        if job is None or job.cancelled():
+            job = Job(key, pool, tier)
+            job.future = _executor(pool).submit(job._run, func, args)
+            job.future.add_done_callback(lambda future: _finished(job))
+            _inflight[key] = job
+            metrics.count(pool + '_jobs', 'started')
+        else:
+            metrics.count(pool + '_jobs', 'shared')
+        if owner is None:
+            # -- Waits without a slot to supersede it: only finishing
+            # -- ends the wait, so the job is never cancelled under it
+            job.waiters.add(object())
+            return job
+        job.waiters.add(owner)
+        previous = _latest.get(owner)
+        _latest[owner] = job
+        if previous is not None and previous is not job:
+            previous._release(owner)
+    return job
+
+
+def depth(pool):
+    # -- Jobs queued or running on pool
+    with _lock:
+        return sum(1 for job in _inflight.values() if job.pool == pool)
+
+
+def _session():
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return None if ctx is None else ctx.session_id
+
+
+def run(slot, key, func, *args):
+    # -- Run func on the pool for this session's slot and wait for it,
+    # -- showing the stage it is at.  Waiting is done in short steps that
+    # -- touch the page, so a rerun for a newer value can stop this one
+    if DSP_WORKERS <= 0:
+        return func(*args, check=lambda stage: None)
+
+    import streamlit as st
+
+    # -- Results differ by quality tier, so jobs are only shared within one
+    session = _session()
+    tier = quality.tier()
+    job = submit((slot, tier) + tuple(key), func, *args,
+                 owner=None if session is None else (session, slot), tier=tier)
+    status = None
+    with metrics.stage('dsp_wait'):
+        while True:
+            try:
+                result = job.future.result(timeout=POLL_INTERVAL)
+                break
+            except TimeoutError:
+                if status is None:
+                    status = st.empty()
+                status.caption("Working: {0}...".format(job.stage))
+    if status is not None:
+        status.empty()
+    metrics.adopt(job.events)
+    return result